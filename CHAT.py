@@ -26,6 +26,9 @@ import shutil
 
 # Gailbot scripts
 import timing 									# Beat / absolute timing transcription module
+import transcript 								# Transcript data model.
+import columnarExport 							# Columnar transcript exports.
+import profiling 								# Post-processing stage profiling.
 
 # *** Global variables / invariants ***
 
@@ -165,7 +168,7 @@ def vals_menu(closure):
         x.add_row(["Current upper bound - micropause",CHATVals['upperBoundMicropause']])
         x.add_row(["Current lower bound - large pause",CHATVals['LargePause']])
         x.add_row(["Current lower bound - laugh probability",CHATVals['lowerBoundLaughAcceptance']])
-        x.add_row(["Current lower bound - laugh length",CHATVals['LowerBoundLaughLength']])
+        x.add_row(["Current lower bound - laugh length (s)",CHATVals['LowerBoundLaughLength']])
         x.add_row(["Current turn end threshold",CHATVals['turnEndThreshold']])
         x.add_row(["Beat transcription mode", CHATVals['beatsMode']])
         x.add_row(["FTO (Floor transfer offset) transcription mode", CHATVals['FTOMode']])
@@ -321,7 +324,7 @@ def formatCHAT(infoList):
     for infoDic in infoList:
         print("Loading file: {}".format(infoDic['outputDir']+"/"+infoDic['jsonFile']))
     for action in CHAT_actions.values(): 
-        infoList = action(infoList)
+        with profiling.stage("CHAT."+action.__name__,infoList): infoList = action(infoList)
         if len(infoList) == 0: return infoList
     print(colored("\nCHAT/CA file generation completed\n",'green'))
     return infoList
@@ -334,8 +337,8 @@ def formatCHAT(infoList):
 def commentMarkers(infoList):
     for infoDic in infoList:
         for elem in infoDic['jsonList'][1:]:
-            if elem[3].find("%HESITATION") != -1:
-                elem[3]=elem[3].replace("%HESITATION","uhm")
+            if elem.text.find("%HESITATION") != -1:
+                elem.text=elem.text.replace("%HESITATION","uhm")
     return infoList
 
 
@@ -344,19 +347,15 @@ def commentMarkers(infoList):
 # Input: Dictionay containing perocessed file information
 def constructTurn(infoList):
     for infoDic in infoList:
-        newList = [] ; count = 0 ; changed = False
-        jsonList = infoDic['jsonList'][1:]
-        jsonList = [elem[:4] for elem in jsonList]				# Extracting transcription relevent data.
-        while count < len(jsonList) - 1:
-            curr = jsonList[count] ; nxt = jsonList[count+1]
-            if nxt[1] - curr[2] <= CHATVals['turnEndThreshold'] and curr[0] == nxt[0]:
-                changed = True
-                jsonList[count] = [curr[0],curr[1],nxt[2],curr[3]+" "+nxt[3]]
-                del jsonList[count+1]
-            else: count +=1
+        jsonList = []
+        for elem in infoDic['jsonList'][1:]:
+            if (len(jsonList) > 0 and elem.speaker == jsonList[-1].speaker
+                and elem.start - jsonList[-1].end <= CHATVals['turnEndThreshold']):
+                jsonList[-1].end = elem.end ; jsonList[-1].text += " "+elem.text
+            else: jsonList.append(transcript.Turn(elem.speaker,elem.start,elem.end,elem.text))
         infoDic['jsonListTurns'] = jsonList
         # Removing extra period markers
-        for elem in jsonList: elem[3]=elem[3].translate({ord('.'):None}) 
+        for elem in jsonList: elem.text=elem.text.translate({ord('.'):None}) 
     return infoList
 
 # directories are grouped.
@@ -387,10 +386,22 @@ def combineTranscripts(infoList):
             item[0]['jsonListCombined'] = item[0]['jsonListTurns'];continue
         for list1 in item[0]['jsonListTurns']: jsonListCombined.append(list1)
         for list2 in item[1]['jsonListTurns']: jsonListCombined.append(list2)
-        jsonListCombined=sorted(jsonListCombined, key = operator.itemgetter(1))
+        jsonListCombined=sorted(jsonListCombined, key = operator.attrgetter('start'))
         for dic in item: dic['jsonListCombined'] = jsonListCombined
     return infoList
 
+# Function that exports the combined turns in the selected columnar formats.
+# Input: list of lists containing dictionaries.
+# Output : list of lists containing dictionaries.
+def exportTurns(infoList):
+    if not columnarExport.enabled(): return infoList
+    for item in infoList:
+        filename = outputFilename(item)
+        paths = columnarExport.exportTurns(item[0]['jsonListCombined'],CHATVals,
+            filename[:filename.rfind('.')])
+        for dic in item: dic['turnExports'] = paths
+    return infoList
+
 # Function that transcribes overlaps
 # Input: list of lists containing dictionaries.
 # Output : list of lists containing dictionaries.
@@ -401,7 +412,7 @@ def overlaps(infoList):
         jsonListCombined = item[0]['jsonListCombined']
         for count,curr in enumerate(jsonListCombined[:-1]):
             nxt = jsonListCombined[count+1]
-            if curr[2] > nxt[1]:
+            if curr.end > nxt.start:
                 pos = overlapPositions(curr,nxt)			# Getting overlap marker positions
                 # Not adding markers if difference is below limit
                 if (abs(pos['posXcurr'] - pos['posYcurr']) <= markerLimit
@@ -409,14 +420,14 @@ def overlaps(infoList):
                     newList.append(curr);continue
                 # Not adding markers if there is no character within limit
                 # Not adding markers encompassing comments.
-                if (not re.search('[a-zA-Z]',curr[3][pos['posXcurr']:pos['posYcurr']])
-                    or not re.search('[a-zA-Z]',curr[3][pos['posXcurr']:pos['posYcurr']])):
+                if (not re.search('[a-zA-Z]',curr.text[pos['posXcurr']:pos['posYcurr']])
+                    or not re.search('[a-zA-Z]',curr.text[pos['posXcurr']:pos['posYcurr']])):
                     newList.append(curr);continue
                 # Adding overlap markers
-                newCurrTrans = curr[3][:pos['posXcurr']] +' < ' + curr[3][pos['posXcurr']:]
-                curr[3] = (newCurrTrans[:pos['posYcurr']] + ' > [>] ' + newCurrTrans[pos['posYcurr']:]).rstrip()
-                newNxtTrans = nxt[3][:pos['posXnxt']] +' < ' + nxt[3][pos['posXnxt']:]
-                nxt[3] = (newNxtTrans[:pos['posYnxt']] + ' > [<] ' + newNxtTrans[pos['posYnxt']:]).rstrip()
+                newCurrTrans = curr.text[:pos['posXcurr']] +' < ' + curr.text[pos['posXcurr']:]
+                curr.text = (newCurrTrans[:pos['posYcurr']] + ' > [>] ' + newCurrTrans[pos['posYcurr']:]).rstrip()
+                newNxtTrans = nxt.text[:pos['posXnxt']] +' < ' + nxt.text[pos['posXnxt']:]
+                nxt.text = (newNxtTrans[:pos['posYnxt']] + ' > [<] ' + newNxtTrans[pos['posYnxt']:]).rstrip()
             newList.append(curr)
         newList.append(jsonListCombined[-1])
         for dic in item: dic['jsonListCombined'] = newList
@@ -439,8 +450,8 @@ def combineSameSpeakerTurns(infoList):
         jsonListCombined = item[0]['jsonListCombined'] ; newList = []
         for count,curr in enumerate(jsonListCombined):
             if len(newList) == 0: newList.append(curr)
-            elif newList[-1][0] == curr[0]:
-                newList[-1][2] = curr[2] ; newList[-1][3] += ' '+curr[3]
+            elif newList[-1].speaker == curr.speaker:
+                newList[-1].end = curr.end ; newList[-1].text += ' '+curr.text
             else: newList.append(curr)
         for dic in item: dic['jsonListCombined'] = newList
     return infoList
@@ -455,10 +466,10 @@ def transcribeFTO(infoList):
     for item in infoList:
         jsonListCombined = item[0]['jsonListCombined'] ; newList = []
         for count,curr in enumerate(jsonListCombined[:-1]):
-            nxt = jsonListCombined[count+1] ; FTO = nxt[1] - curr[2]
-            curr.append(round(FTO,4))
+            nxt = jsonListCombined[count+1] ; FTO = nxt.start - curr.end
+            curr.fto = round(FTO,4)
             if CHATVals['FTOMode']:
-                newItem = ['FTO',curr[2],nxt[1],str(round(FTO,1))] ; newList.extend([curr,newItem])
+                newItem = transcript.Turn('FTO',curr.end,nxt.start,str(round(FTO,1))) ; newList.extend([curr,newItem])
             else: newList.append(curr)
         newList.append(jsonListCombined[-1])
         for dic in item: dic['jsonListCombined'] = newList
@@ -478,24 +489,24 @@ def CHATList(infoList):
     for item in infoList:
         CHATList = [];jsonListCombined = item[0]['jsonListCombined']
         # Formatting speaker ID.
-        for elem in jsonListCombined: elem[0] = '*'+elem[0]+':'
+        for elem in jsonListCombined: elem.speaker = '*'+elem.speaker+':'
         # Removing pause / gap markers.
-        for elem in jsonListCombined: elem[0] = elem[0].replace("**GAP:",'')
-        for elem in jsonListCombined: elem[0] = elem[0].replace("**PAU:",'')
+        for elem in jsonListCombined: elem.speaker = elem.speaker.replace("**GAP:",'')
+        for elem in jsonListCombined: elem.speaker = elem.speaker.replace("**PAU:",'')
         # Converting time to milliseconds
-        for elem in jsonListCombined: elem[1] = int(elem[1]*1000);elem[2]=int(elem[2]*1000)
+        for elem in jsonListCombined: elem.start = int(elem.start*1000);elem.end=int(elem.end*1000)
         # Adding eol delimiter.
         for count,curr in enumerate(jsonListCombined[:-1]):
             nxt = jsonListCombined[count+1]
-            if nxt[0] != '': curr[3] += ' . '
+            if nxt.speaker != '': curr.text += ' . '
         # Adding a carridge return every 80 chars if enabled
         if CHATVals["wrapText"]:
             for elem in jsonListCombined:
-                elem[3]="\n\t".join([elem[3][i:i+80] 
-                         for i in range(0,len(elem[3]),80)])
+                elem.text="\n\t".join([elem.text[i:i+80] 
+                         for i in range(0,len(elem.text),80)])
         # Adding bullets with timing details.
         for elem in jsonListCombined:
-            turn = '{0}\t{1} {4}{2}_{3}{4}\n'.format(elem[0],elem[3].lstrip(),elem[1],elem[2],
+            turn = '{0}\t{1} {4}{2}_{3}{4}\n'.format(elem.speaker,elem.text.lstrip(),elem.start,elem.end,
                         CHATsymbols["bullet"])
             CHATList.append(turn)
         CHATList.append("@End\r")
@@ -541,11 +552,7 @@ def buildCHAT(infoList):
             "@Situation:\t{0}\n@New Episode\n".format(CHATheaders['situation'])
         ]
         # Writing CHAT file.
-        if item[0]['outputDir'].find('/') == -1:
-            CHATfilename = item[0]['outputDir']+'/'+ item[0]['outputDir']+ '-' +CHATname
-        else:
-            name = item[0]['outputDir'][item[0]['outputDir'].rfind('/')+1:]
-            CHATfilename = item[0]['outputDir']+'/'+ name+ '-' +CHATname
+        CHATfilename = outputFilename(item)
         if os.path.isfile(CHATfilename): os.remove(CHATfilename)
         try: 
             with io.open(CHATfilename,"w",encoding = 'utf-8') as outfile:
@@ -559,6 +566,14 @@ def buildCHAT(infoList):
         for elem in item:elem['CHATfilename'] = CHATfilename
     return infoList
 
+# Function that returns the CHAT filename for a conversation.
+# Input: List containing the dictionaries of the conversation.
+def outputFilename(item):
+    if item[0]['outputDir'].find('/') == -1:
+        return item[0]['outputDir']+'/'+ item[0]['outputDir']+ '-' +CHATname
+    name = item[0]['outputDir'][item[0]['outputDir'].rfind('/')+1:]
+    return item[0]['outputDir']+'/'+ name+ '-' +CHATname
+
 # Function that creates a CA file by running shell commands on the created CHAT file.
 # Input: list of lists containing dictionaries.
 # Output : list of lists containing dictionaries.
@@ -611,15 +626,16 @@ CHAT_actions = {
     '2' : constructTurn,
     '3' : groupDictionaries,
     '4' : combineTranscripts,
-    '5' : overlaps,
-    '6' : pauses,
-    '7' : combineSameSpeakerTurns,
-    '8' : transcribeFTO,
-    '9' : gaps,
-    '10' : CHATList,
-    '11' : buildCHAT,
-    '12' : buildCA,
-    '13' : writeCSVs
+    '5' : exportTurns,
+    '6' : overlaps,
+    '7' : pauses,
+    '8' : combineSameSpeakerTurns,
+    '9' : transcribeFTO,
+    '10' : gaps,
+    '11' : CHATList,
+    '12' : buildCHAT,
+    '13' : buildCA,
+    '14' : writeCSVs
 }
 
 # *** Helper functions for various tasks ***
@@ -647,56 +663,56 @@ def get_val(dic,key,type):
 # Input: current and next turn list
 # Returns: Dictionary defining the x and y overlap marker positions for both turn
 def overlapPositions(curr,nxt):
-    startDifference = nxt[1]-curr[1] ; endDifference = curr[2] - nxt[2]
-    currLen = curr[2] - curr[1] ; nxtLen = nxt[2] - nxt[1]
+    startDifference = nxt.start-curr.start ; endDifference = curr.end - nxt.end
+    currLen = curr.end - curr.start ; nxtLen = nxt.end - nxt.start
     sD = startDifference ; eD = endDifference ; cL = currLen ; nL = nxtLen
     # In this case, the overlap is at nxt start and pos x of curr turn.
     if startDifference > 0:
-        posXnxt = 0 ; posXcurr = overlapPos(sD,cL,len(curr[3]))
+        posXnxt = 0 ; posXcurr = overlapPos(sD,cL,len(curr.text))
         # Case-1a: In this case, overlap ends at pos y of curr turn and end of nxt turn
         if endDifference > 0:
-            posYcurr = len(curr[3])- overlapPos(eD,cL,len(curr[3])) ; posYnxt = len(nxt[3])
+            posYcurr = len(curr.text)- overlapPos(eD,cL,len(curr.text)) ; posYnxt = len(nxt.text)
         # Case-1b: In this case, overlap ends at curr turn end and pos y from turn 2 end.
         elif endDifference < 0:
-            posYcurr = len(curr[3]) ; posYnxt = len(nxt[3])-overlapPos(eD,nL,len(nxt[3]))
+            posYcurr = len(curr.text) ; posYnxt = len(nxt.text)-overlapPos(eD,nL,len(nxt.text))
         # Case-1c: In this case, overlap ends at both turn ends.
         elif endDifference == 0:
-            posYcurr = len(curr[3]) ; posYnxt = len(nxt[3])
+            posYcurr = len(curr.text) ; posYnxt = len(nxt.text)
     # In this case, overlap is from start of curr turn to pos x of nxt turn.
     elif startDifference < 0:
-        posXcurr = 0 ; posXnxt = overlapPos(sD,nL,len(nxt[3]))
+        posXcurr = 0 ; posXnxt = overlapPos(sD,nL,len(nxt.text))
         # Case-2a: In this case, overlap ends at posY from curr turn start and end of nxt turn
         if endDifference > 0:
-            posYcurr = len(curr[3])-overlapPos(eD,cL,len(curr[3])) ; posYnxt = len(nxt[3])
+            posYcurr = len(curr.text)-overlapPos(eD,cL,len(curr.text)) ; posYnxt = len(nxt.text)
         # Case-2b: In this case, overlap ends at curr turn ends and posY from nxt turn end.
         elif endDifference < 0:
-            posYcurr = len(curr[3]) ; posYnxt = len(nxt[3])-overlapPos(eD,nL,len(nxt[3]))
+            posYcurr = len(curr.text) ; posYnxt = len(nxt.text)-overlapPos(eD,nL,len(nxt.text))
         # Case-2c: In this case, overlap ends at the end of both turns
         elif endDifference == 0:
-            posYcurr = len(curr[3]) ; posYnxt = len(nxt[3])
+            posYcurr = len(curr.text) ; posYnxt = len(nxt.text)
     # In this case, overlap is from start of both turns.
     elif startDifference == 0:
         posXcurr = 0 ; posXnxt = 0
         # Case-3a: In this case, overlap ends at posY from curr turn start and end of nxt turn
         if endDifference > 0:
-            posYcurr = len(curr[3])-overlapPos(eD,cL,len([3])) ; posYnxt = len(nxt[3])
+            posYcurr = len(curr.text)-overlapPos(eD,cL,len([3])) ; posYnxt = len(nxt.text)
         # Case-3b: In this case, overlap ends at curr turn ends and posY from nxt turn end.
         elif endDifference < 0:
-            posYcurr = len(curr[3]) ; posYnxt = len(nxt[3])-overlapPos(eD,nL,len(nxt[3]))
+            posYcurr = len(curr.text) ; posYnxt = len(nxt.text)-overlapPos(eD,nL,len(nxt.text))
         # Case-3c: In this case, overlap ends at the end of both turns
         elif endDifference == 0:
-            posYcurr = len(curr[3]) ; posYnxt = len(nxt[3])
+            posYcurr = len(curr.text) ; posYnxt = len(nxt.text)
     # Moving values to start or end of individual turns
-    if posXcurr >= len(curr[3]): posXcurr=len(curr[3])-1
-    if posXnxt >= len(nxt[3]): posXnxt = len(nxt[3])-1
-    if posYcurr >= len(curr[3]): posYcurr = len(curr[3])-1
-    if posYnxt >= len(nxt[3]):posYnxt = len(nxt[3])-1
-    while curr[3][posXcurr] != ' ' and posXcurr > 0: posXcurr-=1
-    while curr[3][posYcurr] != ' ' and posYcurr < len(curr[3])-1: posYcurr+=1
-    while nxt[3][posXnxt] != ' ' and posXnxt > 0: posXnxt-=1
-    while nxt[3][posYnxt] != ' ' and posYnxt < len(nxt[3])-1: posYnxt +=1
-    if abs(posYcurr - len(curr[3])) == 1: posYcurr+=1
-    if abs(posYnxt - len(nxt[3])) == 1: posYnxt+=1
+    if posXcurr >= len(curr.text): posXcurr=len(curr.text)-1
+    if posXnxt >= len(nxt.text): posXnxt = len(nxt.text)-1
+    if posYcurr >= len(curr.text): posYcurr = len(curr.text)-1
+    if posYnxt >= len(nxt.text):posYnxt = len(nxt.text)-1
+    while curr.text[posXcurr] != ' ' and posXcurr > 0: posXcurr-=1
+    while curr.text[posYcurr] != ' ' and posYcurr < len(curr.text)-1: posYcurr+=1
+    while nxt.text[posXnxt] != ' ' and posXnxt > 0: posXnxt-=1
+    while nxt.text[posYnxt] != ' ' and posYnxt < len(nxt.text)-1: posYnxt +=1
+    if abs(posYcurr - len(curr.text)) == 1: posYcurr+=1
+    if abs(posYnxt - len(nxt.text)) == 1: posYnxt+=1
     posYcurr+=3 ; posYnxt +=3						# Adding to accomodate new marker(s) in string.
     # Returning position values Dictionary
     return {"posXcurr": posXcurr,"posYcurr":posYcurr,"posXnxt":posXnxt,"posYnxt":posYnxt}
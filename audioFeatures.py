@@ -0,0 +1,107 @@
+'''
+    Script that extracts frame-level audio features for the post-processing
+    modules.
+
+    A single short-time Fourier transform of the audio is computed, and the
+    mel spectrogram, MFCC and RMS features are all derived from its
+    magnitude. The features are computed at 100 frames per second with 25 ms
+    windows at any sampling rate, and are mapped to the mel bands and levels
+    of the reference sampling rate so that lower-rate audio can be analyzed
+    without upsampling it.
+
+    Part of the Gailbot-3 development project.
+'''
+
+import threading
+import warnings
+import numpy 									# Library to have multi-dimensional homogenous arrays.
+import scipy.fftpack 							# Discrete cosine transform.
+import librosa									# Audio signal processing library.
+
+# *** Global variables / invariants ***
+
+# Number of feature frames per second of audio, and window length (seconds).
+FRAME_RATE = 100
+WINDOW_SECONDS = 0.025
+
+# Sampling rate the laughter model was trained at.
+REFERENCE_RATE = 44100
+
+# Number of mel bands and mel frequency cepstral coefficients.
+MEL_BANDS = 12
+MFCC_COUNT = 12
+
+# STFT size the RMS feature was originally computed with. RMS values derived
+# from a smaller STFT are scaled to this size.
+RMS_FFT_SIZE = 2048
+
+# Mel filter banks memoized by (sampling rate, FFT size).
+melBases = {}
+melLock = threading.Lock()
+
+
+# *** Main feature extraction functions ***
+
+# Function that computes the MFCC and RMS features of a time series.
+# Input: Time series, Series sampling rate.
+# Returns: Array of shape (frames, MFCC_COUNT + 1) containing the MFCC
+#          features followed by the RMS of every frame.
+def mfccRMS(timeSeries,samplingRate):
+    magnitude = spectrogram(timeSeries,samplingRate)
+    return numpy.hstack([mfcc(melSpectrogram(magnitude,samplingRate)).T,
+        rms(magnitude,samplingRate).T])
+
+# Function that computes the magnitude spectrogram of a time series.
+# The hop is 10 ms and the window 25 ms, as used by all features.
+# Input: Time series, Series sampling rate.
+# Returns: Magnitude spectrogram of shape (frequency bins, frames).
+def spectrogram(timeSeries,samplingRate):
+    hopLength,nFFT = frameParameters(samplingRate)
+    return numpy.abs(librosa.stft(timeSeries,n_fft=nFFT,hop_length=hopLength,pad_mode='reflect'))
+
+# Function that computes the mel power spectrogram from a magnitude spectrogram.
+# The bin power of a window grows with the square of the FFT size, so it is
+# scaled to the value of the REFERENCE_RATE transform.
+# Input: Magnitude spectrogram, Series sampling rate.
+# Returns: Mel power spectrogram of shape (MEL_BANDS, frames).
+def melSpectrogram(magnitude,samplingRate):
+    nFFT = frameParameters(samplingRate)[1]
+    levelScale = (frameParameters(REFERENCE_RATE)[1]/nFFT)**2
+    return melBasis(samplingRate,nFFT).dot(magnitude**2)*levelScale
+
+# Function that computes the MFCC features from a mel power spectrogram.
+# Uses a DCT type-II transform of the log-power mel spectrogram.
+# Input: Mel power spectrogram.
+# Returns: MFCC features of shape (MFCC_COUNT, frames).
+def mfcc(melPower):
+    return scipy.fftpack.dct(librosa.power_to_db(melPower),axis=0,type=2,norm='ortho')[:MFCC_COUNT]
+
+# Function that computes the root-mean-square value of every frame from a
+# magnitude spectrogram.
+# The mean power of the bins grows with the FFT size, so it is scaled to the
+# value of an RMS_FFT_SIZE transform.
+# Input: Magnitude spectrogram, Series sampling rate.
+# Returns: RMS of shape (1, frames).
+def rms(magnitude,samplingRate):
+    nFFT = frameParameters(samplingRate)[1]
+    return numpy.sqrt(numpy.mean(magnitude**2,axis=0,keepdims=True)*(RMS_FFT_SIZE/nFFT))
+
+
+# *** Helper functions ***
+
+# Function that returns the hop length and FFT size for a sampling rate.
+# Returns: Samples per 10 ms hop, samples per 25 ms window.
+def frameParameters(samplingRate):
+    return int(samplingRate/FRAME_RATE),int(samplingRate*WINDOW_SECONDS)
+
+# Function that returns the mel filter bank for a sampling rate and FFT size.
+# The bands always span the frequencies of the REFERENCE_RATE. Bands above
+# the Nyquist frequency of lower rates are empty, as they are in upsampled audio.
+def melBasis(samplingRate,nFFT):
+    with melLock:
+        if (samplingRate,nFFT) not in melBases:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                melBases[(samplingRate,nFFT)] = librosa.filters.mel(sr=samplingRate,n_fft=nFFT,
+                    n_mels=MEL_BANDS,fmax=REFERENCE_RATE/2)
+        return melBases[(samplingRate,nFFT)]
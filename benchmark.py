@@ -0,0 +1,559 @@
+'''
+    Script that benchmarks Gailbot post-processing functions on synthetic
+    Watson result files and audio.
+
+    The benchmark suite times the post-processing pipeline for 1, 2 and N
+    speakers at several conversation lengths, estimates how each function
+    scales with the transcript length and compares the results with earlier
+    runs stored in a history file to catch regressions.
+
+    Part of the Gailbot-3 development project.
+
+    Usage: python3 benchmark.py getJSON --hours 10
+           python3 benchmark.py suite --durations 1min 1h 10h --speakers 1 2 4
+           python3 benchmark.py laughRates --audio a.wav b.wav --rates 16000 native
+           python3 benchmark.py laughGating --audio a.wav --json a-json.txt
+           python3 benchmark.py laughEngines --model model.h5 --frames 100000
+'''
+
+import argparse 								# Library to extract input arguments
+import json
+import os, sys, time
+import random
+import tempfile
+import tracemalloc 								# Memory allocation tracking.
+import itertools
+import math
+import wave 									# Writing synthetic audio files.
+import subprocess
+import platform
+import numpy 									# Library to have multi-dimensional homogenous arrays.
+from termcolor import colored					# Text coloring library
+
+# Gailbot scripts
+import transcript 								# Script containing the transcript data model.
+
+# *** Global variables / invariants ***
+
+# Words used to build synthetic transcripts.
+vocabulary = ["yeah","so","I","think","that","the","we","were","going","to",
+    "conversation","really","okay","right","and","you","know","laughter",
+    "%HESITATION","actually","probably","something","about","it","like"]
+
+# Synthetic speech parameters.
+syntheticVals = {
+    "wordsPerSecond" : 2.5,
+    "wordsPerResult" : 12,
+    "overlapProbability" : 0.1,     # Probability that a new speaker starts before the previous one ends.
+    "seed" : 0
+}
+
+# Benchmark suite parameters.
+suiteVals = {
+    "durations" : {"1min" : 1/60,"1h" : 1,"10h" : 10},
+    "speakers" : [1,2,4],
+    "historyFile" : "benchmark-history.jsonl",
+    "regressionTolerance" : 0.25,   # Allowed slowdown relative to the previous run.
+    "regressionMinSeconds" : 0.05   # Slowdowns below this are not reported.
+}
+
+# Longest conversation (hours) benchmarked by slow functions.
+# laughFeatures holds the spectrogram of the whole audio, ~3 GB per hour.
+maxHours = {
+    "findSyllables" : 1,
+    "laughFeatures" : 1/6
+}
+
+
+# *** Synthetic data generation ***
+
+# Function that writes a synthetic Watson result file.
+# Input: Output path, conversation length (hours), number of speakers.
+# Returns: Number of words written.
+def syntheticResults(path,hours,speakers=2):
+    rand = random.Random(syntheticVals['seed'])
+    totalWords = int(hours*3600*syntheticVals['wordsPerSecond'])
+    wordLength = 1.0/syntheticVals['wordsPerSecond']
+    labels = [] ; currTime = 0.0 ; written = 0 ; resultIndex = 0 ; speaker = None
+    with open(path,'w') as f:
+        f.write('[\n')
+        while written < totalWords:
+            count = min(syntheticVals['wordsPerResult'],totalWords-written)
+            timestamps = [] ; confidence = []
+            prevSpeaker = speaker
+            speaker = rand.randrange(speakers)
+            if speaker != prevSpeaker and written > 0 and \
+                rand.random() < syntheticVals['overlapProbability']:
+                currTime -= rand.uniform(0.2,1.0)
+            for i in range(count):
+                word = rand.choice(vocabulary)
+                start = round(currTime,2) ; end = round(currTime+wordLength*0.8,2)
+                timestamps.append([word,start,end])
+                confidence.append([word,round(rand.uniform(0.5,1.0),3)])
+                labels.append({"from" : start,"to" : end,"speaker" : speaker,
+                    "confidence" : 0.5,"final" : False})
+                currTime += wordLength
+            currTime += rand.uniform(0.0,1.5)
+            result = {
+                "result_index" : resultIndex,
+                "results" : [{"final" : True,"alternatives" : [{
+                    "transcript" : " ".join(elem[0] for elem in timestamps),
+                    "timestamps" : timestamps,"word_confidence" : confidence}]}],
+                "processing_metrics" : {"periodic" : False,
+                    "processed_audio" : {"received" : round(currTime,2),
+                    "seen_by_engine" : round(currTime,2),
+                    "transcription" : round(currTime,2),
+                    "speaker_labels" : round(currTime,2)}}
+            }
+            if written > 0: f.write(',\n')
+            f.write(json.dumps(result,indent=4,sort_keys=True))
+            written += count ; resultIndex += 1
+        f.write(',\n' + json.dumps({"speaker_labels" : labels},indent=4,sort_keys=True))
+        f.write('\n]')
+    return written
+
+
+# Function that writes a synthetic conversation audio file.
+# Contains a noise floor, voiced segments made of harmonic tones and pulsed
+# laughter-like noise bursts.
+# Input: Output path, length (seconds), sampling rate.
+# Returns: Time series as a float32 array.
+def syntheticAudio(path,seconds,samplingRate=44100):
+    rand = numpy.random.RandomState(syntheticVals['seed'])
+    t = numpy.arange(int(seconds*samplingRate)) / samplingRate
+    series = 0.01 * rand.standard_normal(len(t))
+    segment = 0.0
+    while segment < seconds:
+        length = rand.uniform(0.5,3.0) ; mask = (t >= segment) & (t < segment+length)
+        if rand.random() < 0.2:
+            # Laughter: noise bursts pulsed at ~5 Hz.
+            series[mask] += 0.3 * rand.standard_normal(mask.sum()) * \
+                (numpy.sin(2*numpy.pi*5*t[mask]) > 0)
+        else:
+            pitch = rand.uniform(90,250)
+            for harmonic in range(1,6):
+                series[mask] += 0.2/harmonic * numpy.sin(2*numpy.pi*pitch*harmonic*t[mask])
+        segment += length + rand.uniform(0.1,1.0)
+    series = numpy.clip(series,-1,1).astype(numpy.float32)
+    with wave.open(path,'wb') as f:
+        f.setnchannels(1) ; f.setsampwidth(2) ; f.setframerate(samplingRate)
+        f.writeframes((series*32767).astype('<i2').tobytes())
+    return series
+
+
+# *** Reference implementations ***
+
+# Reference implementation of the original getJSON parser.
+# Loads the entire result file and builds a list of boxed fields per word.
+def legacyGetJSON(path):
+    jsonList = [] ; labels = {}
+    with open(path) as f: jsonObject = json.load(f)
+    for res in jsonObject:
+        if "speaker_labels" not in res:
+            try:
+                processingMetrics = res['processing_metrics']
+                resultIndex = res['result_index'];results = res['results']
+                final = results[0]['final'];wordData = results[0]['alternatives'][0]
+                periodic = processingMetrics['periodic']
+                recieved = processingMetrics['processed_audio']['received']
+                confidenceVals = wordData['word_confidence'];words = wordData['timestamps']
+                if final:
+                    for word,confidence in itertools.zip_longest(words,confidenceVals):
+                            jsonList.append([word[1],word[2],word[0],confidence[1],
+                                periodic,recieved,resultIndex])
+            except KeyError: continue
+        else:
+            for label in res['speaker_labels']: labels.update({label['from']:label['speaker']})
+    for listElem,label in zip(jsonList,labels): listElem.insert(0,labels[label])
+    return jsonList
+
+
+# *** Benchmark functions ***
+
+# Function that measures the wall time and peak memory of a function call.
+# Returns: Dictionary containing the measured values.
+def measure(func,*args):
+    start = time.perf_counter() ; func(*args)
+    wallTime = time.perf_counter() - start
+    tracemalloc.start() ; func(*args)
+    peak = tracemalloc.get_traced_memory()[1] ; tracemalloc.stop()
+    return {"seconds" : round(wallTime,3),"peakMB" : round(peak/(1<<20),1)}
+
+# Function that compares the original and streaming result file parsers.
+# Input: Conversation length (hours).
+def benchGetJSON(hours):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp,"synthetic-json.txt")
+        print(colored("Generating {} hour synthetic result file...".format(hours),'blue'))
+        words = syntheticResults(path,hours)
+        print("Words: {0}\nFile size: {1} MB\n".format(words,
+            round(os.path.getsize(path)/(1<<20),1)))
+        legacy = measure(legacyGetJSON,path)
+        streaming = measure(transcript.readWordTable,path)
+    print("json.load parser: {0} s, peak {1} MB".format(legacy['seconds'],legacy['peakMB']))
+    print("Streaming columnar parser: {0} s, peak {1} MB".format(streaming['seconds'],
+        streaming['peakMB']))
+    return {"legacy" : legacy,"streaming" : streaming}
+
+# Function that compares the memory used per word by list rows, word records
+# and the columnar word table.
+# Input: Conversation length (hours).
+def benchRecords(hours):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp,"synthetic-json.txt")
+        words = syntheticResults(path,hours)
+        results = {}
+        tracemalloc.start() ; rows = legacyGetJSON(path)
+        results['rows'] = tracemalloc.get_traced_memory()[0] ; tracemalloc.stop() ; del rows
+        tracemalloc.start() ; table = transcript.readWordTable(path)
+        results['table'] = tracemalloc.get_traced_memory()[0]
+        records = table.records(table.speakers().tolist()) ; del table
+        results['records'] = tracemalloc.get_traced_memory()[0] ; tracemalloc.stop() ; del records
+    for k,v in results.items(): results[k] = round(v/words,1)
+    print("Bytes per word:\nList rows: {0}\nWord records: {1}\nWord table: {2}".format(
+        results['rows'],results['records'],results['table']))
+    return results
+
+# *** Laughter analysis rate validation ***
+
+# Function that compares the laughter detected at lower analysis rates with
+# the laughter detected at the rate the model was trained at.
+# Features are recomputed for every rate; the feature store is not used.
+# Input: List of audio files, list of analysis rates (see laughVals).
+# Returns: List of result dictionaries, one per file and rate.
+def benchLaughRates(audioFiles,rates):
+    import laughAnalysis, featureStore, CHAT
+    threshold = CHAT.CHATVals['lowerBoundLaughAcceptance']
+    minLength = CHAT.CHATVals['LowerBoundLaughLength']
+    settings = (dict(laughAnalysis.laughVals),dict(featureStore.featureVals))
+    featureStore.featureVals['enabled'] = False ; results = []
+    try:
+        for audioFile in audioFiles:
+            detected = {}
+            for rate in [laughAnalysis.AUDIO_SAMPLE_RATE]+rates:
+                laughAnalysis.laughVals['analysisRate'] = rate
+                seconds,probs = timeCall(laughAnalysis.laughProbabilities,audioFile,
+                    laughAnalysis.predictLaughter)
+                if probs is None: break
+                detected[rate] = (seconds,laughAnalysis.getLaughterInstances(probs,threshold,minLength))
+            if len(detected) == 0: continue
+            refSeconds,reference = detected.pop(laughAnalysis.AUDIO_SAMPLE_RATE)
+            for rate,(seconds,instances) in detected.items():
+                results.append({"audioFile" : audioFile,"rate" : rate,
+                    "seconds" : round(seconds,2),"speedup" : round(refSeconds/max(seconds,1e-9),2),
+                    "reference" : len(reference),"detected" : len(instances),
+                    "recall" : matchedFraction(reference,instances),
+                    "precision" : matchedFraction(instances,reference),
+                    "overlap" : overlapRatio(reference,instances)})
+    finally:
+        laughAnalysis.laughVals.update(settings[0]) ; featureStore.featureVals.update(settings[1])
+    print("\n{0:<30}{1:>8}{2:>9}{3:>9}{4:>11}{5:>9}{6:>11}{7:>9}".format("Audio file","Rate",
+        "Seconds","Speedup","Reference","Recall","Precision","Overlap"))
+    for res in results:
+        print("{0:<30}{rate:>8}{seconds:>9}{speedup:>9}{reference:>11}{recall:>9}{precision:>11}"
+            "{overlap:>9}".format(os.path.basename(res['audioFile'])[-30:],**res))
+    return results
+
+# Function that compares the laughter detected with and without gating.
+# Input: List of audio files, list of the Watson result files of the audio files.
+# Returns: List of result dictionaries, one per file.
+def benchLaughGating(audioFiles,jsonFiles):
+    import laughAnalysis, featureStore, CHAT
+    threshold = CHAT.CHATVals['lowerBoundLaughAcceptance']
+    minLength = CHAT.CHATVals['LowerBoundLaughLength']
+    results = []
+    for audioFile,jsonFile in zip(audioFiles,jsonFiles):
+        table = transcript.readWordTable(jsonFile)
+        speech = laughAnalysis.speechIntervals(table.records(table.speakers().tolist()))
+        # The first analysis stores the features and loads the model, so that
+        # the timed analyses mostly time the model.
+        if laughAnalysis.laughProbabilities(audioFile,laughAnalysis.predictLaughter) is None: continue
+        features = featureStore.load(featureStore.featureKey(audioFile,laughAnalysis.featureParameters()))
+        refSeconds,probs = timeCall(laughAnalysis.laughProbabilities,audioFile,
+            laughAnalysis.predictLaughter)
+        reference = laughAnalysis.getLaughterInstances(probs,threshold,minLength)
+        seconds,probs = timeCall(laughAnalysis.laughProbabilities,audioFile,
+            laughAnalysis.predictLaughter,speech)
+        instances = laughAnalysis.getLaughterInstances(probs,threshold,minLength)
+        skipped = 1 - laughAnalysis.candidateFrames(features,speech).mean() \
+            if features is not None else float('nan')
+        results.append({"audioFile" : audioFile,"skipped" : round(float(skipped),3),
+            "seconds" : round(seconds,2),"speedup" : round(refSeconds/max(seconds,1e-9),2),
+            "reference" : len(reference),"detected" : len(instances),
+            "recall" : matchedFraction(reference,instances),
+            "precision" : matchedFraction(instances,reference),
+            "overlap" : overlapRatio(reference,instances)})
+    print("\n{0:<30}{1:>9}{2:>9}{3:>9}{4:>11}{5:>9}{6:>11}{7:>9}".format("Audio file","Skipped",
+        "Seconds","Speedup","Reference","Recall","Precision","Overlap"))
+    for res in results:
+        print("{0:<30}{skipped:>9}{seconds:>9}{speedup:>9}{reference:>11}{recall:>9}{precision:>11}"
+            "{overlap:>9}".format(os.path.basename(res['audioFile'])[-30:],**res))
+    return results
+
+# Function that compares the startup time, memory use and outputs of the
+# laughter model inference engines.
+# Every engine runs in a fresh process so that its imports are measured. The
+# peak memory is measured once the model is loaded.
+# Input: Path to the Keras model (exported next to it for the numpy engine),
+#        number of frames predicted.
+# Returns: List of result dictionaries, one per engine.
+def benchLaughEngines(modelPath,frames):
+    import numpyModel
+    exportPath = os.path.splitext(modelPath)[0]+".npz" ; results = []
+    if not os.path.isfile(exportPath): numpyModel.exportModel(modelPath,exportPath)
+    with tempfile.TemporaryDirectory() as tmp:
+        outputs = {}
+        for engine in ["keras","numpy"]:
+            outputPath = os.path.join(tmp,engine+".npy")
+            proc = subprocess.run([sys.executable,"-c",engineScript,os.path.abspath(modelPath),
+                engine,str(frames),outputPath],cwd=os.path.dirname(os.path.abspath(__file__)),
+                stdout=subprocess.PIPE,universal_newlines=True)
+            if proc.returncode != 0:
+                print(colored("WARNING: {} engine failed".format(engine),'red')) ; continue
+            results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+            outputs[engine] = numpy.load(outputPath)
+        if len(outputs) == 2:
+            for res in results:
+                res['maxDifference'] = float(numpy.abs(outputs['numpy']-outputs['keras']).max())
+    print("\n{0:<8}{1:>10}{2:>10}{3:>12}{4:>12}{5:>12}{6:>15}".format("Engine","Import",
+        "Load","Predict","Peak MB","Tensorflow","Max difference"))
+    for res in results:
+        print("{engine:<8}{importSeconds:>10}{loadSeconds:>10}{predictSeconds:>12}{peakRSSMB:>12}"
+            "{tensorflow!s:>12}{0:>15.2e}".format(res.get('maxDifference',float('nan')),**res))
+    return results
+
+# Script that loads and runs the laughter model with one engine.
+# Arguments: Model path, engine, number of frames, output path.
+engineScript = """
+import sys, time, json, resource
+start = time.perf_counter()
+import numpy, laughAnalysis
+importSeconds = time.perf_counter() - start
+modelPath,engine,frames,outputPath = sys.argv[1],sys.argv[2],int(sys.argv[3]),sys.argv[4]
+laughAnalysis.modelPath = modelPath ; laughAnalysis.laughVals['engine'] = engine
+start = time.perf_counter() ; model = laughAnalysis.loadModel()
+laughAnalysis.warmupModel(model) ; loadSeconds = time.perf_counter() - start
+# Peak memory once the model is loaded, before the inputs are allocated.
+rssScale = 1 if sys.platform == 'darwin' else 1024
+peakRSSMB = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*rssScale/(1<<20)
+inputs = numpy.random.RandomState(0).standard_normal((frames,)+model.inputShape).astype(numpy.float32)
+start = time.perf_counter() ; outputs = model.predict(inputs,batch_size=4096)
+predictSeconds = time.perf_counter() - start
+numpy.save(outputPath,numpy.asarray(outputs).reshape(frames))
+print(json.dumps({"engine" : engine,"importSeconds" : round(importSeconds,3),
+    "loadSeconds" : round(loadSeconds,3),"predictSeconds" : round(predictSeconds,3),
+    "peakRSSMB" : round(peakRSSMB,1),
+    "tensorflow" : "tensorflow" in sys.modules}))
+"""
+
+# Function that returns the fraction of intervals that overlap an interval of
+# another sorted interval list.
+# Input: Sorted lists of (start, end) intervals.
+def matchedFraction(intervals,others):
+    if len(intervals) == 0: return 1.0
+    matched = 0 ; j = 0
+    for start,end in intervals:
+        while j < len(others) and others[j][1] < start: j += 1
+        if j < len(others) and others[j][0] <= end: matched += 1
+    return round(matched/len(intervals),3)
+
+# Function that returns the duration shared by two sorted interval lists
+# divided by the duration covered by either of them.
+# Input: Sorted lists of non-overlapping (start, end) intervals.
+def overlapRatio(intervals,others):
+    shared = 0.0 ; i = j = 0
+    while i < len(intervals) and j < len(others):
+        shared += max(0.0,min(intervals[i][1],others[j][1]) - max(intervals[i][0],others[j][0]))
+        if intervals[i][1] < others[j][1]: i += 1
+        else: j += 1
+    total = sum(end-start for start,end in intervals) + sum(end-start for start,end in others)
+    return round(shared/(total-shared),3) if total > shared else 1.0
+
+
+# *** Benchmark suite ***
+
+# Function that times a single call.
+# Returns: Elapsed seconds, value returned by the call.
+def timeCall(func,*args):
+    start = time.perf_counter() ; result = func(*args)
+    return time.perf_counter() - start, result
+
+# Function that runs the post-processing pipeline on one synthetic
+# conversation and times every benchmarked function.
+# The modules are imported here so that the parser benchmarks above do not
+# require the audio and neural network libraries.
+# Input: Temporary directory, conversation length (hours), number of speakers.
+# Returns: Dictionary mapping function names to elapsed seconds, word count.
+def benchConversation(tmp,hours,speakers):
+    import postProcessing, CHAT, rateAnalysis, laughAnalysis, audioFeatures
+    path = os.path.join(tmp,"synthetic-json.txt")
+    words = syntheticResults(path,hours,speakers)
+    names = ["SP{}".format(i+1) for i in range(min(speakers,2))]
+    infoDic = {"outputDir" : tmp,"jsonFile" : "synthetic-json.txt","names" : names,
+        "audioFile" : "synthetic.wav","individualAudioFile" : "synthetic.wav"}
+    times = {}
+    times['getJSON'],jsonList = timeCall(postProcessing.getJSON,infoDic)
+    # Naming speakers that assignSpeakers does not name.
+    for word in jsonList:
+        if not isinstance(word.speaker,str): word.speaker = "SP{}".format(word.speaker+1)
+    infoDic['jsonList'] = [list(postProcessing.CSVfields)] + jsonList
+    infoList = CHAT.commentMarkers([infoDic])
+    times['constructTurn'],infoList = timeCall(CHAT.constructTurn,infoList)
+    times['rateAnnotations'],_ = timeCall(rateAnalysis.rateAnnotations,[dict(infoDic)])
+    if hours <= maxHours['findSyllables']:
+        times['findSyllables'],_ = timeCall(rateAnalysis.findSyllables,infoDic['jsonListTurns'])
+    infoList = CHAT.groupDictionaries(infoList)
+    for name,func in [("combineTranscripts",CHAT.combineTranscripts),("overlaps",CHAT.overlaps),
+        ("pauses",CHAT.pauses),("combineSameSpeakerTurns",CHAT.combineSameSpeakerTurns),
+        ("transcribeFTO",CHAT.transcribeFTO),("gaps",CHAT.gaps),("CHATList",CHAT.CHATList)]:
+        times[name],infoList = timeCall(func,infoList)
+    if hours <= maxHours['laughFeatures']:
+        series = syntheticAudio(os.path.join(tmp,"synthetic.wav"),hours*3600,
+            laughAnalysis.AUDIO_SAMPLE_RATE)
+        times['laughFeatures'],_ = timeCall(laughFeatures,series,
+            laughAnalysis.AUDIO_SAMPLE_RATE)
+        times['mfccRMS'],_ = timeCall(audioFeatures.mfccRMS,series,laughAnalysis.AUDIO_SAMPLE_RATE)
+        times['mfccRMSSeparate'],_ = timeCall(separateSpectrograms,series,
+            laughAnalysis.AUDIO_SAMPLE_RATE)
+    return times,words
+
+# Function that builds the laughter model inputs of every frame in batches,
+# as done before prediction.
+# Returns: Number of frames.
+def laughFeatures(series,samplingRate):
+    import laughAnalysis
+    features = laughAnalysis.frameFeatures(series,samplingRate)
+    return sum(len(batch) for batch in laughAnalysis.modelInputs(features))
+
+# Function that computes the MFCC and RMS features with separate spectrograms,
+# as done before audioFeatures. Used as the reference for mfccRMS.
+def separateSpectrograms(series,samplingRate):
+    import librosa
+    mfccFeatures = librosa.feature.mfcc(y=series,sr=samplingRate,n_mfcc=12,n_mels=12,
+        hop_length=int(samplingRate/100),dct_type=2,n_fft=int(samplingRate/40)).T
+    magnitude,phase = librosa.magphase(librosa.stft(series,hop_length=int(samplingRate/100)))
+    return numpy.hstack([mfccFeatures,librosa.feature.rmse(S=magnitude).T])
+
+# Function that estimates the scaling exponent of every function.
+# The exponent is the slope of log(time) against log(words): ~1 for linear
+# and ~2 for quadratic functions.
+# Input: List of result dictionaries.
+# Returns: Dictionary mapping (function, speakers) to the exponent.
+def scaling(results):
+    points = {}
+    for res in results:
+        if res['seconds'] <= 0: continue
+        points.setdefault((res['function'],res['speakers']),[]).append(
+            (math.log(res['words']),math.log(res['seconds'])))
+    slopes = {}
+    for key,values in points.items():
+        if len(set(x for x,y in values)) < 2: continue
+        x,y = numpy.array(values).T
+        slopes[key] = round(float(numpy.polyfit(x,y,1)[0]),2)
+    return slopes
+
+# Function that compares results with the latest earlier run in the history.
+# Input: List of result dictionaries, list of earlier runs.
+# Returns: List of (result, previous seconds) that are slower than allowed.
+def regressions(results,history):
+    previous = {}
+    for run in history:
+        for res in run['results']:
+            previous[(res['function'],res['speakers'],res['duration'])] = res['seconds']
+    slower = []
+    for res in results:
+        prev = previous.get((res['function'],res['speakers'],res['duration']))
+        if prev is None: continue
+        if res['seconds'] > prev*(1+suiteVals['regressionTolerance']) and \
+            res['seconds'] - prev > suiteVals['regressionMinSeconds']:
+            slower.append((res,prev))
+    return slower
+
+# Function that returns the current git commit, if available.
+def gitCommit():
+    try:
+        return subprocess.check_output(['git','rev-parse','--short','HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError,subprocess.CalledProcessError): return None
+
+# Function that runs the benchmark suite and records it in the history file.
+# Input: Duration names, speaker counts, history file (None to skip).
+# Returns: True if no regressions were found.
+def benchSuite(durations,speakers,historyFile):
+    results = []
+    for duration,count in itertools.product(durations,speakers):
+        hours = suiteVals['durations'][duration]
+        print(colored("Benchmarking {0} conversation with {1} speaker(s)...".format(
+            duration,count),'blue'))
+        with tempfile.TemporaryDirectory() as tmp:
+            times,words = benchConversation(tmp,hours,count)
+        for function,seconds in times.items():
+            results.append({"function" : function,"speakers" : count,"duration" : duration,
+                "words" : words,"seconds" : round(seconds,6)})
+    slopes = scaling(results)
+    history = []
+    if historyFile is not None and os.path.exists(historyFile):
+        with open(historyFile) as f: history = [json.loads(line) for line in f if line.strip()]
+    slower = regressions(results,history)
+    # Printing results.
+    print("\n{0:<26}{1:>9}{2:>10}{3:>10}{4:>12}".format("Function","Speakers","Duration",
+        "Words","Seconds"))
+    for res in results:
+        print("{function:<26}{speakers:>9}{duration:>10}{words:>10}{seconds:>12}".format(**res))
+    print("\nScaling exponent (1 = linear, 2 = quadratic):")
+    for (function,count),slope in sorted(slopes.items()):
+        line = "{0:<26}{1} speaker(s): {2}".format(function,count,slope)
+        print(colored(line,'red') if slope > 1.3 else line)
+    for res,prev in slower:
+        print(colored("REGRESSION: {function} ({speakers} speaker(s), {duration}): ".format(**res) +
+            "{0} s, previously {1} s".format(res['seconds'],prev),'red'))
+    if historyFile is not None:
+        with open(historyFile,'a') as f:
+            f.write(json.dumps({"time" : time.strftime("%Y-%m-%dT%H:%M:%S"),"commit" : gitCommit(),
+                "python" : platform.python_version(),"results" : results,
+                "scaling" : ["{0}/{1}: {2}".format(k[0],k[1],v) for k,v in sorted(slopes.items())]})+"\n")
+    return len(slower) == 0
+
+# Mapping between benchmark names and functions.
+benchmarks = {
+    "getJSON" : benchGetJSON,
+    "records" : benchRecords
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Benchmarks for Gailbot post-processing functions')
+    parser.add_argument('benchmark',choices=list(benchmarks.keys())+["suite","laughRates","laughGating","laughEngines"])
+    parser.add_argument('--hours',type=float,default=10,
+        help = 'Length of the synthetic conversation (hours)')
+    parser.add_argument('--durations',nargs='+',default=list(suiteVals['durations'].keys()),
+        choices=list(suiteVals['durations'].keys()),help = 'Conversation lengths (suite)')
+    parser.add_argument('--speakers',nargs='+',type=int,default=suiteVals['speakers'],
+        help = 'Numbers of speakers (suite)')
+    parser.add_argument('--history',default=suiteVals['historyFile'],
+        help = 'History file used to detect regressions (suite)')
+    parser.add_argument('--no-history',action='store_true',
+        help = 'Do not read or record the history (suite)')
+    parser.add_argument('--audio',nargs='+',default=[],
+        help = 'Audio files to analyze (laughRates)')
+    parser.add_argument('--rates',nargs='+',default=["16000","native"],
+        help = 'Analysis rates compared with 44100 Hz (laughRates)')
+    parser.add_argument('--json',nargs='+',default=[],
+        help = 'Watson result files of the audio files (laughGating)')
+    parser.add_argument('--model',default='./model.h5',
+        help = 'Keras model, exported with numpyModel.py for the numpy engine (laughEngines)')
+    parser.add_argument('--frames',type=int,default=100000,
+        help = 'Number of frames predicted (laughEngines)')
+    args = parser.parse_args()
+    if args.benchmark == "laughRates":
+        benchLaughRates(args.audio,[rate if rate == "native" else int(rate) for rate in args.rates])
+        sys.exit(0)
+    if args.benchmark == "laughGating":
+        benchLaughGating(args.audio,args.json) ; sys.exit(0)
+    if args.benchmark == "laughEngines":
+        benchLaughEngines(args.model,args.frames) ; sys.exit(0)
+    if args.benchmark == "suite":
+        passed = benchSuite(args.durations,args.speakers,None if args.no_history else args.history)
+        sys.exit(0 if passed else 1)
+    benchmarks[args.benchmark](args.hours)
@@ -0,0 +1,133 @@
+'''
+    Script that exports word-level and turn-level transcript data in columnar
+    formats (Parquet, Feather, Arrow) for corpus-scale analysis.
+
+    Exports are optional and require the pyarrow library.
+
+    Part of the Gailbot-3 development project.
+'''
+
+import numpy 									# Library to have multi-dimensional homogenous arrays.
+from termcolor import colored					# Text coloring library
+
+try:
+    import pyarrow 								# Columnar data library.
+    import pyarrow.parquet
+    import pyarrow.feather
+except ImportError: pyarrow = None
+
+# Gailbot scripts
+import transcript 								# Transcript data model.
+
+# *** Global variables / invariants ***
+
+# Dictionary containing the export parameters.
+exportVals = {
+    "formats" : []          # Any of: parquet, feather, arrow
+}
+exportValsOriginal = exportVals.copy()
+
+# Extensions of the supported export formats.
+extensions = {
+    "parquet" : ".parquet",
+    "feather" : ".feather",
+    "arrow" : ".arrow"
+}
+
+# Suffix added to the turn table filename.
+turnSuffix = "-turns"
+
+# Set once the missing pyarrow warning is shown.
+warned = []
+
+
+# *** Main export functions ***
+
+# Function that determines whether columnar exports are enabled and available.
+def enabled():
+    if len(exportVals['formats']) == 0: return False
+    if pyarrow is None:
+        if len(warned) == 0:
+            print(colored("\nWARNING: pyarrow is not installed. Columnar exports skipped\n",'red'))
+            warned.append(True)
+        return False
+    return True
+
+# Function that exports the word-level transcript of a file.
+# Input: List of word records, output path without extension.
+# Returns: List of written files.
+def exportWords(words,basePath):
+    columns = {field : [getattr(word,field) for word in words]
+        for field in transcript.Word.__slots__}
+    table = pyarrow.table({
+        "speaker" : pyarrow.array(columns['speaker'],pyarrow.string()).dictionary_encode(),
+        "start" : pyarrow.array(columns['start'],pyarrow.float64()),
+        "end" : pyarrow.array(columns['end'],pyarrow.float64()),
+        "text" : pyarrow.array(columns['text'],pyarrow.string()),
+        "confidence" : pyarrow.array(columns['confidence'],pyarrow.float64()),
+        "periodic" : pyarrow.array(columns['periodic'],pyarrow.bool_()),
+        "received" : pyarrow.array(columns['received'],pyarrow.float64()),
+        "resultIndex" : pyarrow.array(columns['resultIndex'],pyarrow.int64())})
+    return writeTable(table,basePath)
+
+# Function that exports the combined turn-level transcript of a conversation.
+# Adds the following columns computed from the turn following each turn:
+#   fto : Floor transfer offset (seconds).
+#   overlap : Overlap with the next turn (seconds), 0 if there is none.
+#   pause : Silence before the same speaker continues (seconds).
+#   pauseType : latch / micropause / pause / largePause, based on CHATVals.
+#   gap : Whether the silence before the next speaker is a gap.
+# Input: List of turn records sorted by start time, CHATVals,
+#        output path without extension.
+# Returns: List of written files.
+def exportTurns(turns,CHATVals,basePath):
+    start = numpy.array([turn.start for turn in turns],dtype=numpy.float64)
+    end = numpy.array([turn.end for turn in turns],dtype=numpy.float64)
+    speaker = pyarrow.array([str(turn.speaker) for turn in turns],pyarrow.string()).dictionary_encode()
+    speakerIds = speaker.indices.to_numpy(zero_copy_only=False)
+    fto = numpy.full(len(turns),numpy.nan) ; fto[:-1] = start[1:] - end[:-1]
+    sameSpeaker = numpy.zeros(len(turns),dtype=bool)
+    sameSpeaker[:-1] = speakerIds[1:] == speakerIds[:-1]
+    diff = numpy.round(fto,2)
+    with numpy.errstate(invalid='ignore'):
+        pauseType = numpy.select([
+            (diff >= CHATVals['lowerBoundLatch']) & (diff <= CHATVals['upperBoundLatch']),
+            (diff >= CHATVals['lowerBoundPause']) & (diff <= CHATVals['upperBoundPause']),
+            (diff >= CHATVals['lowerBoundMicropause']) & (diff <= CHATVals['upperBoundMicropause']),
+            diff > CHATVals['LargePause']],["latch","pause","micropause","largePause"],default="")
+        pauseType[~sameSpeaker] = ""
+        gap = ~sameSpeaker & (diff >= CHATVals['gap'])
+        overlap = numpy.where(fto < 0,-fto,0.0)
+    table = pyarrow.table({
+        "speaker" : speaker,
+        "start" : start,
+        "end" : end,
+        "text" : pyarrow.array([turn.text for turn in turns],pyarrow.string()),
+        "fto" : pyarrow.array(fto,from_pandas=True),
+        "overlap" : overlap,
+        "pause" : pyarrow.array(numpy.where(sameSpeaker,fto,numpy.nan),from_pandas=True),
+        "pauseType" : pyarrow.array(pauseType.tolist(),pyarrow.string()).dictionary_encode(),
+        "gap" : gap})
+    return writeTable(table,basePath+turnSuffix)
+
+
+# *** Helper functions ***
+
+# Function that writes a table in all selected formats.
+# Input: pyarrow Table, output path without extension.
+# Returns: List of written files.
+def writeTable(table,basePath):
+    paths = []
+    for fmt in exportVals['formats']:
+        if fmt not in extensions:
+            print(colored("WARNING: Unknown export format: {}".format(fmt),'red')) ; continue
+        path = basePath + extensions[fmt]
+        if fmt == "parquet": pyarrow.parquet.write_table(table,path)
+        elif fmt == "feather": pyarrow.feather.write_feather(table,path)
+        else:
+            # Uncompressed Arrow IPC file that can be memory-mapped.
+            with pyarrow.OSFile(path,'wb') as sink:
+                writer = pyarrow.RecordBatchFileWriter(sink,table.schema)
+                writer.write_table(table) ; writer.close()
+        paths.append(path)
+    return paths
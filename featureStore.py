@@ -0,0 +1,116 @@
+'''
+    Script that stores frame-level audio features on disk so that they are
+    only computed once per audio file.
+
+    Features are stored as .npy files named by a key computed from the
+    contents of the audio file and the feature parameters, and are loaded as
+    memory-mapped arrays. Once the store grows beyond its size limit, the
+    least recently used features are deleted.
+
+    Part of the Gailbot-3 development project.
+'''
+
+import os
+import tempfile
+import threading
+import numpy 									# Library to have multi-dimensional homogenous arrays.
+
+# Gailbot scripts
+import stageCache 								# Content-addressed cache keys.
+
+# *** Global variables / invariants ***
+
+# Dictionary containing the feature store parameters.
+featureVals = {
+    "enabled" : True,               # Stores features on disk.
+    "directory" : "./.features",    # Directory containing the stored features.
+    "maxMB" : 4096                  # Size limit of the store.
+}
+featureValsOriginal = featureVals.copy()
+
+evictLock = threading.Lock()
+
+
+# *** Main feature store functions ***
+
+# Function that computes the key of the features of an audio file.
+# Input: Path to the audio file, JSON serializable feature parameters.
+# Returns: Hex digest identifying the features.
+def featureKey(audioFile,params):
+    return stageCache.stageKey("features",None,[audioFile],params)
+
+# Function that loads stored features.
+# Input: Feature key.
+# Returns: Read-only memory-mapped array, or None if the features are not stored.
+def load(key):
+    if not featureVals['enabled']: return None
+    path = featurePath(key)
+    try:
+        features = numpy.load(path,mmap_mode='r')
+        # Marking the features as recently used.
+        os.utime(path,None)
+    except (OSError,ValueError): return None
+    return features
+
+# Function that creates an array for new features.
+# The array is memory-mapped to a temporary file in the store, so that the
+# features do not have to fit in memory.
+# Input: Feature key, shape of the features.
+# Returns: Writable array, which must be passed to commit or discard.
+def create(key,shape):
+    if not featureVals['enabled']: return numpy.zeros(shape,dtype=numpy.float32)
+    os.makedirs(featureVals['directory'],exist_ok=True)
+    fd,tmpPath = tempfile.mkstemp(dir=featureVals['directory'],suffix=".tmp") ; os.close(fd)
+    return numpy.lib.format.open_memmap(tmpPath,mode='w+',dtype=numpy.float32,shape=shape)
+
+# Function that adds the features written to an array returned by create to the store.
+# Input: Feature key, array returned by create.
+# Returns: Stored features.
+def commit(key,features):
+    if not isinstance(features,numpy.memmap): return features
+    features.flush() ; tmpPath = features.filename ; del features
+    os.replace(tmpPath,featurePath(key))
+    evict(key)
+    return load(key)
+
+# Function that deletes an array returned by create without storing it.
+def discard(features):
+    if not isinstance(features,numpy.memmap): return
+    tmpPath = features.filename ; del features
+    try: os.remove(tmpPath)
+    except OSError: pass
+
+# Function that stores features computed in memory.
+# Input: Feature key, array of features.
+# Returns: Stored features.
+def save(key,features):
+    if not featureVals['enabled']: return features
+    stored = create(key,features.shape)
+    stored[:] = features
+    return commit(key,stored)
+
+
+# *** Helper functions ***
+
+# Function that returns the path of stored features.
+def featurePath(key):
+    return os.path.join(featureVals['directory'],key+".npy")
+
+# Function that deletes the least recently used features until the store is
+# smaller than its size limit.
+# Input: Key of features that must be kept.
+def evict(keep=None):
+    with evictLock:
+        entries = []
+        for name in os.listdir(featureVals['directory']):
+            if not name.endswith(".npy"): continue
+            try: stat = os.stat(os.path.join(featureVals['directory'],name))
+            except OSError: continue
+            entries.append((stat.st_mtime,stat.st_size,name))
+        size = sum(entry[1] for entry in entries)
+        for mtime,fileSize,name in sorted(entries):
+            if size <= featureVals['maxMB']*(1<<20): break
+            if name == "{}.npy".format(keep): continue
+            try: os.remove(os.path.join(featureVals['directory'],name))
+            except OSError: pass
+            size -= fileSize
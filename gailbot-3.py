@@ -55,6 +55,14 @@ import language_model							# Script that selects language models
 import acoustic_model							# script that selects acoustic models
 import postProcessing 							# Script that performs post-processing.
 import CHAT										# script to produce CHAT files.
+import watchFolder 								# Script that watches a directory for new media.
+import columnarExport 							# Script to export transcripts in columnar formats.
+import profiling 								# Script to profile post-processing stages.
+import syllables 								# Script that counts syllables.
+import rateAnalysis 							# Script to analyze speech rate.
+import laughAnalysis 							# Script to analyze laughter.
+import modelRegistry 							# Script that shares models between jobs.
+import featureStore 							# Script that stores audio features.
 
 # Audio processing libraries
 from pydub import AudioSegment
@@ -188,12 +196,13 @@ def main_menu(username,password,closure):
 			+'\nGailbot is an automated transcription system '
 			'that specializes in transcribing in the Conversation Analysis (CA)'
 			' format\n')
-		print("Use options 1 through 4 to configure and use Gailbot\n")
+		print("Use options 1 through 5 to configure and use Gailbot\n")
 		print("Please choose one of the following options:\n")
 		print("1. Transcribe existing conversation(s)")
 		print("2. Record and transcribe a conversation")
 		print("3. Apply post-processing on existing Gailbot data")
-		print(colored("4. Quit\n",'red'))
+		print("4. Watch a directory and transcribe new media")
+		print(colored("5. Quit\n",'red'))
 		try: choice = input(" >>  ")
 		except KeyboardInterrupt:
 			print(colored("\n\nKeyboard cancelation caught\nExiting...\n",'red'))
@@ -320,6 +329,24 @@ def transcribe_recorded(username,password,closure):
 		if not request_menu(username,password,closure): return 
 	sendRequest(username,password,closure)
 
+# Function that watches a directory and transcribes media as it is added.
+# Uses the current request and post-processing defaults.
+def transcribe_watch(username,password,closure):
+	localDic = {}
+	print("Enter the directory to watch\nPress 0 to go back to options\n")
+	print(colored("NOTE: Results are written next to the media files\n",'red'))
+	if get_val(localDic,'directory',str) == None: return
+	if not os.path.isdir(localDic['directory']):
+		print(colored("\nERROR: Directory not found\n",'red'))
+		input(colored("Press any key to return to the main menu...",'red')) ; return
+	# Selecting post-processing modules to be implemented
+	if not postProcessing.main_menu(): return
+	os.system('clear')
+	extensions = list(audioFormatMapping.values()) + list(videoFormats.values())
+	watchFolder.watch(localDic['directory'],watchRequest,(username,password,closure),
+		extensions)
+	input(colored("Press any key to return to the main menu...",'red'))
+
 # Exit program
 def exit(username,password,closure):
 	resizeOriginal(TERMcols,TERMrows)
@@ -331,7 +358,8 @@ menu_actions = {
 	'1' : transcribe_recorded,
 	'2' : transcribe_new,
 	'3' : postProcessing.runLocal,
-	'4' : exit
+	'4' : transcribe_watch,
+	'5' : exit
 }
 
 # *** Definitions for functions used in the recording menu ***
@@ -642,6 +670,19 @@ def get_val(dic,key,type):
 # Function that sends requests to Watson.
 def sendRequest(username,password,closure):
 	os.system('clear')
+	runRequest(username,password,closure)
+	input("\nRequest Processed\nPress any key to continue")
+	# Restoring defaults after request
+	closure['watsonDefaults'] = False
+	watsonDefaults(username,password,closure)
+	recordDefaults(username,password,closure)
+	time.sleep(0.5)
+	# Preventing the reactor from restarting.
+	os.system('reset')
+	os.execl(sys.executable, sys.executable, *sys.argv)	
+
+# Function that transcribes and post-processes the files in watsonVals.
+def runRequest(username,password,closure):
 	# Setting request variables.
 	if watsonVals['token-type'] == 'Access' : token = 0
 	elif watsonVals['token-type'] == 'Watson' : token = 1
@@ -679,15 +720,31 @@ def sendRequest(username,password,closure):
 	postProcessing.postProcess(outputInfo)
 	# Deleting generated opus files
 	while not deleteQueue.empty(): os.remove(deleteQueue.get_nowait())
-	input("\nRequest Processed\nPress any key to continue")
-	# Restoring defaults after request
-	closure['watsonDefaults'] = False
-	watsonDefaults(username,password,closure)
-	recordDefaults(username,password,closure)
-	time.sleep(0.5)
-	# Preventing the reactor from restarting.
-	os.system('reset')
-	os.execl(sys.executable, sys.executable, *sys.argv)	
+
+# Function that transcribes a batch of files found by the watch-folder module.
+# Runs in a separate process for every batch.
+# Output directories are created next to the media files.
+def watchRequest(username,password,closure,files):
+	pairDic = {"files" : []}
+	watsonVals['username'] = username
+	watsonVals['password'] = password
+	if not verifyFormat(videoFormats,audioFormatMapping,files): return
+	files,pairDic = extractAudio(files,pairDic)
+	files,pairDic = convertOpus(files,deleteQueue,pairDic)
+	for file in files:
+		if file in watsonVals['output-directory']: continue
+		dirName = file[:file.rfind('.')]
+		# Opus files are transcribed into the directory of the original file.
+		for suffix in ["-speaker1","-speaker2"]:
+			if dirName.endswith(suffix) and os.path.isdir(dirName[:-len(suffix)]):
+				dirName = dirName[:-len(suffix)]
+		watsonVals['output-directory'][file] = dirName
+		os.makedirs(dirName,exist_ok=True)
+	watsonVals['contentType'] = setContentType(audioFormatMapping,files)
+	setSpeakers(files,pairDic)
+	overlay(pairDic['files'],watsonVals['output-directory'])
+	watsonVals['files'] = files
+	runRequest(username,password,closure)
 
 # Function that converts audio to ogg / opus format.
 # Requires opusend exe : https://mf4.xiph.org/jenkins/view/opus/job/opus-tools/ws/man/opusenc.html
@@ -695,7 +752,7 @@ def convertOpus(audiofileList,queue,pairDic):
 	names = []
 	for audiofile in audiofileList:
 		if os.path.getsize(audiofile) > maxChunkBytes:
-			opusName = audiofile[:audiofile.find('.')] + ".opus"
+			opusName = audiofile[:audiofile.rfind('.')] + ".opus"
 			cmd = shellCommands['convertOpus'].format(audiofile,opusName)
 			subprocess.call(cmd, shell=True)
 			names.append(opusName)
@@ -722,8 +779,8 @@ def extractAudio(fileList,pairDic):
 	newList = []
 	for file in fileList:
 		for k,v in videoFormatChannels.items():
-			extension = file[file.find('.')+1:].lower()
-			fileName = file[:file.find('.')+1]
+			extension = file[file.rfind('.')+1:].lower()
+			fileName = file[:file.rfind('.')+1]
 			if not extension in videoFormatChannels: 
 				cmd = ''
 				newList.append(file)
@@ -758,8 +815,11 @@ def verifyFormat(videoFormatDic,audioFormatDic,fileList):
 def setOutputDir(fileList,dirName):
 	for file in fileList: watsonVals['output-directory'].update({file:dirName})
 	if os.path.exists(dirName):
-		input(colored("\nWARNING: ", 'red') + "Overwriting existing directory: {}\n" 
-			"Press any key to continue\n".format(dirName))
+		# Requests from the watch-folder mode have no input and overwrite.
+		try:
+			input(colored("\nWARNING: ", 'red') + "Overwriting existing directory: {}\n" 
+				"Press any key to continue\n".format(dirName))
+		except EOFError: pass
 		tmp = tempfile.mktemp(dir=os.path.dirname(dirName))
 		shutil.move(dirName, tmp)
 		shutil.rmtree(tmp)
@@ -917,6 +977,24 @@ def config():
 	if 'Gailbot' in dic.keys():
 		for k,v in dic['Gailbot']['recordingVals'].items(): recordingVals[k] = v
 		for k,v in dic['Gailbot']['watsonVals'].items(): watsonVals[k] = v
+	if 'Watch' in dic.keys():
+		for k,v in dic['Watch']['watchVals'].items(): watchFolder.watchVals[k] = v
+	if 'PostProcessing' in dic.keys():
+		for k,v in dic['PostProcessing']['postProcessVals'].items(): postProcessing.postProcessVals[k] = v
+	if 'Export' in dic.keys():
+		for k,v in dic['Export']['exportVals'].items(): columnarExport.exportVals[k] = v
+	if 'Profiling' in dic.keys():
+		for k,v in dic['Profiling']['profileVals'].items(): profiling.profileVals[k] = v
+	if 'Syllables' in dic.keys():
+		for k,v in dic['Syllables']['syllableVals'].items(): syllables.syllableVals[k] = v
+	if 'RateAnalysis' in dic.keys():
+		for k,v in dic['RateAnalysis']['rateVals'].items(): rateAnalysis.rateVals[k] = v
+	if 'Laughter' in dic.keys():
+		for k,v in dic['Laughter']['laughVals'].items(): laughAnalysis.laughVals[k] = v
+	if 'Models' in dic.keys():
+		for k,v in dic['Models']['registryVals'].items(): modelRegistry.registryVals[k] = v
+	if 'Features' in dic.keys():
+		for k,v in dic['Features']['featureVals'].items(): featureStore.featureVals[k] = v
 
 
 
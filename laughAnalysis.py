@@ -13,13 +13,17 @@
 
 import argparse 								# Library to extract input arguments
 import os, sys 									# General system libraries.
+import math
+import contextlib
+import multiprocessing 							# Process start methods.
+import concurrent.futures 						# Laughter analysis process pool.
 import librosa									# Audio signal processing library.
-import keras 									# Deep learning framework.
+import soundfile 								# Reading audio files in blocks.
 #import matplotlib.pyplot as plt 				# Library to visualize mfcc features.
 #import librosa.display 						# Library to display signal.
 import numpy 									# Library to have multi-dimensional homogenous arrays.
+from numpy.lib.stride_tricks import as_strided 	# Windowed views of the features.
 import scipy.signal as signal					# Used to apply the lowpass filter.
-import tensorflow as tf 						# Deep neural network library
 import operator
 import logging
 from termcolor import colored
@@ -27,6 +31,13 @@ import audioread
 
 # Gailbot scripts
 import CHAT										# Script to produce CHAT files.
+import transcript 								# Transcript data model.
+import stageCache 								# Cache for post-processing outputs.
+import profiling 								# Post-processing stage profiling.
+import modelRegistry 							# Models shared by post-processing jobs.
+import audioFeatures 							# Frame-level audio features.
+import featureStore 							# On-disk store of audio features.
+import numpyModel 								# Keras models evaluated with NumPy.
 
 # Just disables the warning, doesn't enable AVX/FMA
 import os
@@ -34,10 +45,42 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
 # *** Global variables / invariants ***
 
-# Sampling rate for the time series that is loaded.
-AUDIO_SAMPLE_RATE = 44100
+# Sampling rate the laughter model was trained at.
+AUDIO_SAMPLE_RATE = audioFeatures.REFERENCE_RATE
+
+# Dictionary containing the laughter analysis parameters.
+laughVals = {
+	"streaming" : True, 		# Analyzes the audio in blocks instead of loading the whole file.
+	"blockSeconds" : 60, 		# Seconds of audio analyzed at a time in streaming mode.
+	"analysisRate" : 44100, 	# Sampling rate the audio is analyzed at: 44100 / 16000 / native
+	"workers" : 4, 				# Maximum number of laughter analysis processes. 0 uses all CPUs.
+	"threadsPerWorker" : 0, 	# Threads used by every process. 0 divides the CPUs between them.
+	"gating" : False, 			# Only runs the model on frames that may contain laughter.
+	"gateConfidence" : 0.9, 	# Frames of words recognized with this confidence are skipped.
+	"gateSilenceDB" : 50, 		# Frames this much quieter than the loudest frame are skipped.
+	"gateMinSeconds" : 0.2, 	# Candidate regions shorter than this are skipped.
+	"gateMarginSeconds" : 0.1, 	# Candidate regions are widened by this margin.
+	"engine" : "auto" 			# Model inference engine: auto / numpy / keras
+}
+laughValsOriginal = laughVals.copy()
+
+# Number of features per frame: MFCC, RMS and their first and second deltas.
+FEATURE_COLUMNS = 3*(audioFeatures.MFCC_COUNT + 1)
+
+# Seconds of audio added before and after every block in streaming mode so
+# that the features of frames at the block edges have their full context.
+STREAM_CONTEXT_SECONDS = 1
+
+# Environment variables that limit the threads of the numerical libraries.
+THREAD_VARIABLES = ["OMP_NUM_THREADS","OPENBLAS_NUM_THREADS","MKL_NUM_THREADS",
+	"VECLIB_MAXIMUM_THREADS","NUMEXPR_NUM_THREADS"]
+
+# True in laughter and post-processing worker processes, which do not start
+# laughter analysis processes of their own.
+poolWorker = False
 
 # Path for the trained audio model in Hierarchical Data Format.
+# The model is exported for the numpy engine with: python3 numpyModel.py model.h5
 modelPath = './model.h5'
 
 
@@ -47,79 +90,552 @@ modelPath = './model.h5'
 # Input: jsonList constructed during Gailbot operation
 # 		Uses dic['individualAudioFile']
 def analyzeLaugh(infoList):
-	# Loading the existing trained and compiled model to detect laughter.
+	infoList = laughInstances(infoList)
+	for dic in infoList: applyLaughInstances(dic)
+	return infoList
+
+# Function that detects laughter in the individual audio file of every file
+# without changing the transcript.
+# Adds dic['laughInstances']: List of (start, end) times of detected laughter.
+def laughInstances(infoList):
 	print(colored("Analyzing laughter...",'blue'))
-	try: model = keras.models.load_model(modelPath,compile=False)
-	except OSError:
+	if not os.path.isfile(modelFile()):
 		print(colored("\nLaughter analysis unsuccessful",'red'))
-		print("File missing: {}\n".format(modelPath)) ; return infoList
+		print("File missing: {}\n".format(modelFile()))
+		for dic in infoList: dic['laughInstances'] = []
+		return infoList
+	audioFiles = {dic['outputDir']+"/"+dic['individualAudioFile'] : dic['outputDir'] for dic in infoList}
+	# Timing of the recognized words used to skip frames when gating.
+	speech = {dic['outputDir']+"/"+dic['individualAudioFile'] :
+		speechIntervals(dic['jsonList'][1:]) if laughVals['gating'] else None for dic in infoList}
+	# Probabilities that are not cached are computed by a process pool first.
+	missing = [audioFile for audioFile,outputDir in audioFiles.items()
+		if not stageCache.contains(outputDir,probabilityKey(audioFile,speech=speech[audioFile]))]
+	if poolSize(poolJobs(missing)) > 1:
+		for audioFile,filtered in poolProbabilities(missing,speech).items():
+			if filtered is not None: stageCache.store(audioFiles[audioFile],
+				probabilityKey(audioFile,speech=speech[audioFile]),filtered)
 	for dic in infoList:
-		dic['jsonList'] = segmentLaugh(audioFile= dic['outputDir']+"/"+dic['individualAudioFile'],
-			modelPath=modelPath,outputPath=dic['outputDir'],
+		dic['laughInstances'] = segmentLaugh(audioFile= dic['outputDir']+"/"+dic['individualAudioFile'],
+			modelPath=modelFile(),outputPath=dic['outputDir'],
 			threshold=CHAT.CHATVals['lowerBoundLaughAcceptance'],
-			minLength=CHAT.CHATVals['LowerBoundLaughLength'],
-			jsonList=dic['jsonList'],model=model)
+			minLength=CHAT.CHATVals['LowerBoundLaughLength'],predict=predictLaughter,
+			speech=speech[dic['outputDir']+"/"+dic['individualAudioFile']])
+	if modelFile() in modelRegistry.models: print(modelRegistry.summary(modelFile()))
 	print(colored("\nLaughter analysis completed\n",'green'))
 	return infoList
 
+# Function that returns the laughter probability of a batch of frames.
+# The model is loaded by the model registry once per process, and only if a
+# laughter probability track is not cached.
+# Input: Array of model inputs, one row per frame.
+# Returns: Array containing the probability of every frame.
+def predictLaughter(batch):
+	return modelRegistry.predict(modelFile(),loadModel,warmupModel,batch).reshape(len(batch))
+
+# Function that loads the trained laughter model with the selected engine.
+def loadModel():
+	if modelEngine() == "numpy": return numpyModel.NumpyModel(modelFile())
+	return KerasModel(modelPath)
+
+# Function that returns the engine used to run the laughter model.
+# The auto engine uses NumPy if the model has been exported, and Keras otherwise.
+# Returns: numpy / keras
+def modelEngine():
+	if laughVals['engine'] == "auto": return "numpy" if os.path.isfile(exportPath()) else "keras"
+	return laughVals['engine']
+
+# Function that returns the model file used by the selected engine.
+def modelFile():
+	return exportPath() if modelEngine() == "numpy" else modelPath
+
+# Function that returns the path of the model exported for the numpy engine.
+def exportPath():
+	return os.path.splitext(modelPath)[0]+".npz"
+
+# Function that warms up the laughter model with a single prediction.
+def warmupModel(model):
+	model.predict(numpy.zeros((1,)+model.inputShape,dtype=numpy.float32),batch_size=1)
+
+# Class that runs a Keras model in the graph and session it was loaded in, so
+# that it can be used from any thread.
+class KerasModel:
+
+	def __init__(self,path):
+		# Keras and Tensorflow are only imported when this engine is used.
+		import keras 								# Deep learning framework.
+		import tensorflow as tf 					# Deep neural network library
+		self.model = keras.models.load_model(path,compile=False)
+		# Building the predict function before the model is used by other threads.
+		self.model._make_predict_function()
+		self.graph = tf.compat.v1.get_default_graph()
+		self.session = keras.backend.get_session()
+		self.inputShape = tuple(self.model.input_shape[1:])
+
+	def predict(self,inputs,batch_size=32):
+		with self.graph.as_default(), self.session.as_default():
+			return self.model.predict(inputs,batch_size=batch_size)
+
+# Function that adds the laughter found by laughInstances to the transcript.
+def applyLaughInstances(dic):
+	if len(dic['laughInstances']) > 0:
+		dic['jsonList'] = transcribeLaugh(dic['jsonList'],dic['laughInstances'])
+	return dic
+
 # Function that calls all relevant laughter analysis functions
 # Inputs: Audio file name, trained audio model path, output Path,
 #			Lower bound for laugh acceptance probability,
-#			Minimum audio length to be classified as laughter.
-#			Inidividual word jsonList
-# Returns: Transcribed audio list / jsonList.
-def segmentLaugh(audioFile, modelPath, outputPath,threshold, minLength,
-	jsonList,model):
+#			Minimum audio length to be classified as laughter (seconds).
+#			Function that returns the laughter probability of a batch of frames,
+#			Intervals of recognized speech to skip (no gating by default).
+# Returns: List of (start, end) times of detected laughter.
+def segmentLaugh(audioFile, modelPath, outputPath,threshold, minLength,predict,speech=None):
+	key = probabilityKey(audioFile,modelPath,speech)
+	filtered = stageCache.load(outputPath,key)
+	if filtered is None:
+		filtered = laughProbabilities(audioFile,predict,speech)
+		if filtered is None: return []
+		stageCache.store(outputPath,key,filtered)
+	return getLaughterInstances(filtered, threshold, minLength)
+
+# Function that computes the filtered laughter probability of every frame.
+# When gating, frames that cannot contain laughter have probability 0.
+# Inputs: Audio file name, function that returns the laughter probability of
+#		  a batch of frames, intervals of recognized speech to skip (no
+#		  gating by default).
+# Returns: Filtered probabilities, or None if the audio cannot be loaded.
+def laughProbabilities(audioFile,predict,speech=None):
 	print("\nLoading audio file: {0}".format(audioFile))
+	if not os.path.isfile(audioFile):
+		print(colored("ERROR: File not found: {}".format(audioFile),'red')) ; return None
+	# Features stored by a previous run are used without decoding the audio.
+	key = featureStore.featureKey(audioFile,featureParameters())
+	features = featureStore.load(key)
+	if features is None and laughVals['streaming']: features = streamFeatures(audioFile,key)
+	if features is None:
+		features = fileFeatures(audioFile)
+		if features is None: return None
+		features = featureStore.save(key,features)
+
+	# Generating output prediction for input samples, one batch at a time.
+	candidates = candidateFrames(features,speech)
+	if speech is not None: print(gatingSummary(candidates))
+	with profiling.stage("laughAnalysis.predict",[]):
+		probs = numpy.zeros(len(features),dtype=numpy.float32)
+		for start,end in batchRanges(candidates):
+			probs[start:end] = predict(next(modelInputs(features,batchSize=end-start,
+				frames=slice(start,end))))
 
+	# Filtering the input signal using the butterworth filter.
+	return lowpass(probs)
+
+# Function that computes the features of an audio file one block at a time,
+# so that memory does not depend on the length of the recording.
+# Every block is read with STREAM_CONTEXT_SECONDS of context on both sides and
+# resampled separately. Blocks start on whole seconds, so that their frames
+# line up with the frames of the whole file.
+# Inputs: Audio file name, feature store key.
+# Returns: Features of every frame (see frameFeatures), or None if the file
+#		   cannot be read in blocks.
+def streamFeatures(audioFile,key):
+	try: audio = soundfile.SoundFile(audioFile)
+	except RuntimeError: return None
+	with audio:
+		totalFrames,starts = blockLayout(audio)
+		features = featureStore.create(key,(totalFrames,FEATURE_COLUMNS))
+		try:
+			for start in starts:
+				frame,rows = blockFeatures(audio,start)
+				features[frame:frame+len(rows)] = rows
+		except BaseException:
+			featureStore.discard(features) ; raise
+	return featureStore.commit(key,features)
+
+# Function that returns the number of frames and the blocks of an audio file.
+# Input: Open SoundFile.
+# Returns: Number of frames, list of block start times (seconds).
+def blockLayout(audio):
+	rate = analysisRate(audio.samplerate) ; hopLength = audioFeatures.frameParameters(rate)[0]
+	totalFrames = 1 + int(math.ceil(audio.frames*rate/audio.samplerate)) // hopLength
+	blockSeconds = max(int(laughVals['blockSeconds']),1)
+	return totalFrames,list(range(0,int(math.ceil(totalFrames*hopLength/rate)),blockSeconds))
+
+# Function that computes the features of a single block of an audio file.
+# Input: Open SoundFile, block start time (seconds).
+# Returns: Index of the first frame of the block, features of the block frames.
+def blockFeatures(audio,start):
+	nativeRate = audio.samplerate ; blockSeconds = max(int(laughVals['blockSeconds']),1)
+	rate = analysisRate(nativeRate) ; framesPerSecond = rate / audioFeatures.frameParameters(rate)[0]
+	totalFrames = blockLayout(audio)[0]
+	first = max(start-STREAM_CONTEXT_SECONDS,0)
+	audio.seek(first*nativeRate)
+	block = audio.read((start+blockSeconds+STREAM_CONTEXT_SECONDS-first)*nativeRate,
+		dtype='float32',always_2d=True).mean(axis=1)
+	if nativeRate != rate:
+		block = librosa.resample(block,orig_sr=nativeRate,target_sr=rate)
+	offset = int((start-first)*framesPerSecond) ; frame = int(start*framesPerSecond)
+	count = int(min(blockSeconds*framesPerSecond,totalFrames-frame))
+	with profiling.stage("laughAnalysis.getFeatureList",[]):
+		return frame,frameFeatures(block,rate)[offset:offset+count]
+
+# Function that computes the features of a whole audio file at once.
+# Input: Audio file name.
+# Returns: Features of every frame (see frameFeatures), or None if the file
+#		   is not an audio file.
+def fileFeatures(audioFile):
 	# Loading the audio signal as a time series and obtaining its sampling rate.
-	try: timeSeries, samplingRate = librosa.load(audioFile,sr =AUDIO_SAMPLE_RATE)
-	except FileNotFoundError:
-		print(colored("ERROR: File not found: {}".format(audioFile),'red')) ; return jsonList
+	try: timeSeries, samplingRate = librosa.load(audioFile,sr =None)
 	except audioread.exceptions.NoBackendError:
 		print(colored("\nERROR: File is not an audio file: {}\n".format(audioFile),'red'))
-		return jsonList
-	# Getting a list of different audio features for analysis.
-	featureList = getFeatureList(timeSeries,samplingRate)
-
-	# Generating output prediction for input samples.
-	probs = model.predict_proba(featureList,verbose=1)
-
-	# Reshaping the tensor to the specified shape for further use in the neural 
-	# network/
-	probs = probs.reshape(len(probs))
-
-	# Filtering the input signal using the butterworth filter.
-	filtered = lowpass(probs)
-	instances = getLaughterInstances(filtered, threshold, minLength)
-
-	# Transcribing the laughter in the jsonList
-	jsonList = transcribeLaugh(jsonList,instances)
-
-	return jsonList
+		return None
+	if analysisRate(samplingRate) != samplingRate:
+		timeSeries = librosa.resample(timeSeries,orig_sr=samplingRate,
+			target_sr=analysisRate(samplingRate))
+		samplingRate = analysisRate(samplingRate)
+	with profiling.stage("laughAnalysis.getFeatureList",[]):
+		return frameFeatures(timeSeries,samplingRate)
+
+# Function that returns the sampling rate an audio file is analyzed at.
+# Rates without a whole number of samples per 10 ms frame are analyzed at
+# AUDIO_SAMPLE_RATE, so that frames stay 10 ms long.
+# Input: Native sampling rate of the audio file.
+def analysisRate(nativeRate):
+	rate = nativeRate if laughVals['analysisRate'] == "native" else int(laughVals['analysisRate'])
+	return rate if rate % audioFeatures.FRAME_RATE == 0 else AUDIO_SAMPLE_RATE
+
+# Function that returns the cache key of the filtered probabilities of an audio file.
+# The filtered probability track only depends on the audio and the model
+# and is cached separately from the acceptance thresholds.
+# Gated probabilities also depend on the gating parameters and the speech.
+def probabilityKey(audioFile,model=None,speech=None):
+	params = {"analysisRate" : laughVals['analysisRate'],"streaming" : laughVals['streaming'],
+		"blockSeconds" : laughVals['blockSeconds']}
+	if speech is not None:
+		params['gating'] = {"confidence" : laughVals['gateConfidence'],
+			"silenceDB" : laughVals['gateSilenceDB'],"minSeconds" : laughVals['gateMinSeconds'],
+			"margin" : laughVals['gateMarginSeconds'],"speech" : speech}
+	return stageCache.stageKey("laughProbs",None,[audioFile,model or modelFile()],params)
+
+# Function that returns the parameters that determine the stored features.
+# The analysis rate is stored as configured; the native rate of a file is
+# determined by its contents, which are part of the key.
+def featureParameters():
+	return {"analysisRate" : laughVals['analysisRate'],"referenceRate" : AUDIO_SAMPLE_RATE,
+		"frameRate" : audioFeatures.FRAME_RATE,"windowSeconds" : audioFeatures.WINDOW_SECONDS,
+		"mfcc" : audioFeatures.MFCC_COUNT,"mels" : audioFeatures.MEL_BANDS,
+		"columns" : FEATURE_COLUMNS,"streaming" : laughVals['streaming'],
+		"blockSeconds" : laughVals['blockSeconds']}
+
+# Function that returns the laughter parameters that change the detected laughter.
+# The number of processes and threads and the engine do not change it.
+def laughParameters():
+	params = {key : laughVals[key] for key in ["analysisRate","streaming","blockSeconds","gating"]}
+	if laughVals['gating']:
+		params.update({key : laughVals[key] for key in ["gateConfidence","gateSilenceDB",
+			"gateMinSeconds","gateMarginSeconds"]})
+	return params
+
+# Function that returns the digest identifying the trained laughter model.
+# The exported model is derived from the Keras model, so both engines share
+# the digest of the Keras model unless only the exported model exists.
+def modelDigest():
+	return stageCache.fileDigest(modelPath) or stageCache.fileDigest(exportPath())
+
+
+# *** Laughter gating functions ***
+
+# Function that returns the intervals of confidently recognized speech.
+# Input: Word records of a transcript.
+# Returns: List of (start, end) times of words recognized with at least
+#		   the gating confidence.
+def speechIntervals(words):
+	return [(word.start,word.end) for word in words
+		if word.confidence is not None and word.confidence >= laughVals['gateConfidence']]
+
+# Function that returns the frames the laughter model is run on.
+# When gating, frames inside confidently recognized words and silent frames
+# are skipped. Remaining regions shorter than gateMinSeconds, such as the
+# pauses between words, are skipped as well, and the others are widened by
+# gateMarginSeconds so that the edges of laughter are kept. The RMS feature
+# is used as the energy.
+# Inputs: Features returned by frameFeatures, intervals of recognized speech
+#		  (None to run the model on every frame).
+# Returns: Boolean array that is True for every frame the model is run on.
+def candidateFrames(features,speech):
+	if speech is None: return numpy.ones(len(features),dtype=bool)
+	rms = numpy.asarray(features[:,audioFeatures.MFCC_COUNT],dtype=numpy.float64)
+	loudest = max(rms.max(),1e-10) if len(rms) > 0 else 1e-10
+	candidates = 20*numpy.log10(numpy.maximum(rms,1e-10)/loudest) > -laughVals['gateSilenceDB']
+	# Marking the frames covered by recognized words.
+	if len(speech) > 0:
+		times = numpy.array(speech,dtype=numpy.float64)*audioFeatures.FRAME_RATE
+		bounds = numpy.zeros(len(features)+1,dtype=numpy.int64)
+		numpy.add.at(bounds,numpy.clip(numpy.floor(times[:,0]).astype(int),0,len(features)),1)
+		numpy.add.at(bounds,numpy.clip(numpy.ceil(times[:,1]).astype(int),0,len(features)),-1)
+		candidates &= numpy.cumsum(bounds)[:-1] <= 0
+	# Removing short candidate regions.
+	starts,ends = frameRuns(candidates)
+	for start,end in zip(starts.tolist(),ends.tolist()):
+		if end-start < laughVals['gateMinSeconds']*audioFeatures.FRAME_RATE: candidates[start:end] = False
+	# Widening the candidate regions.
+	margin = int(laughVals['gateMarginSeconds']*audioFeatures.FRAME_RATE)
+	counts = numpy.concatenate([[0],numpy.cumsum(candidates)])
+	index = numpy.arange(len(features))
+	return counts[numpy.minimum(index+margin+1,len(features))] - counts[numpy.maximum(index-margin,0)] > 0
+
+# Function that returns the frame ranges predicted as a single model batch.
+# Consecutive candidate frames are split into batches of the model registry
+# batch size, so all frames are predicted in the same batches without gating.
+# Input: Boolean array returned by candidateFrames.
+# Returns: List of (first frame, end frame) ranges.
+def batchRanges(candidates):
+	batchSize = modelRegistry.registryVals['batchSize']
+	starts,ends = frameRuns(candidates)
+	return [(start,min(start+batchSize,end)) for first,end in zip(starts.tolist(),ends.tolist())
+		for start in range(first,end,batchSize)]
+
+# Function that returns a line describing the frames skipped by gating.
+def gatingSummary(candidates):
+	return "Laughter gating skipped {0:.1%} of {1} frames".format(
+		1-candidates.mean() if len(candidates) > 0 else 0,len(candidates))
+
+
+# *** Process pool functions ***
+
+# Function that returns the number of laughter analysis processes for a list of jobs.
+# Returns: Number of processes, 1 if the jobs should run in the current process.
+def poolSize(jobs):
+	if poolWorker or len(jobs) <= 1: return 1
+	return max(min(laughVals['workers'] or os.cpu_count(),len(jobs)),1)
+
+# Function that returns the feature extraction jobs of a list of audio files.
+# Stored features need no job. Long files are split into blocks when
+# streaming; other files are a single job.
+# Input: List of audio file names.
+# Returns: List of (audio file, block start time or None) jobs.
+def poolJobs(audioFiles):
+	jobs = []
+	for audioFile in audioFiles:
+		if not os.path.isfile(audioFile): continue
+		if featureStore.load(featureStore.featureKey(audioFile,featureParameters())) is not None:
+			jobs.append((audioFile,None)) ; continue
+		try:
+			if not laughVals['streaming']: raise RuntimeError
+			with soundfile.SoundFile(audioFile) as audio: starts = blockLayout(audio)[1]
+		except RuntimeError: starts = [None]
+		jobs.extend((audioFile,start) for start in starts)
+	return jobs
+
+# Function that computes the filtered laughter probabilities of audio files
+# using a pool of processes.
+# Features are extracted one block per job, and predictions are made one
+# model batch per job, so that a single long file also uses every process.
+# Every process loads its own model. Results match laughProbabilities.
+# Input: List of audio file names, dictionary mapping audio files to the
+#		 intervals of recognized speech to skip (no gating by default).
+# Returns: Dictionary mapping audio files to filtered probabilities, or to
+#		   None if the audio cannot be loaded.
+def poolProbabilities(audioFiles,speech=None):
+	speech = speech or {} ; jobs = poolJobs(audioFiles) ; workers = poolSize(jobs)
+	print("\nAnalyzing {0} audio files using {1} processes".format(
+		len(set(job[0] for job in jobs)),workers))
+	with laughPool(workers) as executor:
+		with profiling.stage("laughAnalysis.getFeatureList",[]):
+			features = poolFeatures(executor,jobs)
+		# Predicting one model batch per job.
+		with profiling.stage("laughAnalysis.predict",[]):
+			futures = {} ; probs = {}
+			for audioFile,fileFeatures in features.items():
+				if fileFeatures is None: continue
+				candidates = candidateFrames(fileFeatures,speech.get(audioFile))
+				if speech.get(audioFile) is not None:
+					print("{0}: {1}".format(os.path.basename(audioFile),gatingSummary(candidates)))
+				probs[audioFile] = numpy.zeros(len(fileFeatures),dtype=numpy.float32)
+				for start,end in batchRanges(candidates):
+					rows,first,last = batchRows(fileFeatures,start,end)
+					futures[executor.submit(poolPredict,rows,first,last)] = (audioFile,start,end)
+			for future in concurrent.futures.as_completed(futures):
+				audioFile,start,end = futures[future]
+				probs[audioFile][start:end] = future.result()
+	# Filtering the probabilities using the butterworth filter.
+	return {audioFile : lowpass(probs[audioFile]) if audioFile in probs else None
+		for audioFile in audioFiles}
+
+# Function that extracts the features of audio files using a process pool.
+# Input: Process pool, jobs returned by poolJobs.
+# Returns: Dictionary mapping audio files to their stored features, or to
+#		   None if the audio cannot be loaded.
+def poolFeatures(executor,jobs):
+	features = {} ; futures = {} ; streamed = []
+	try:
+		for audioFile,start in jobs:
+			key = featureStore.featureKey(audioFile,featureParameters())
+			if audioFile not in features:
+				features[audioFile] = featureStore.load(key)
+				if features[audioFile] is not None: continue
+				if start is not None:
+					with soundfile.SoundFile(audioFile) as audio: totalFrames = blockLayout(audio)[0]
+					features[audioFile] = featureStore.create(key,(totalFrames,FEATURE_COLUMNS))
+					streamed.append(audioFile)
+			elif audioFile not in streamed: continue
+			if start is None: futures[executor.submit(fileFeatures,audioFile)] = (audioFile,key)
+			else: futures[executor.submit(poolBlockFeatures,audioFile,start)] = (audioFile,key)
+		for future in concurrent.futures.as_completed(futures):
+			audioFile,key = futures[future]
+			if audioFile in streamed:
+				frame,rows = future.result()
+				features[audioFile][frame:frame+len(rows)] = rows
+			else:
+				rows = future.result()
+				features[audioFile] = None if rows is None else featureStore.save(key,rows)
+	except BaseException:
+		for audioFile in streamed: featureStore.discard(features[audioFile])
+		raise
+	for audioFile in streamed:
+		features[audioFile] = featureStore.commit(
+			featureStore.featureKey(audioFile,featureParameters()),features[audioFile])
+	return features
+
+# Function that returns the feature rows required to predict a model batch.
+# Input: Features returned by frameFeatures, range of frames, half window size.
+# Returns: Feature rows, first frame, end frame, where the frames of the
+#		   batch are rows[first:end].
+def batchRows(features,start,end,window_size=37):
+	first = max(start-window_size,0)
+	return numpy.asarray(features[first:min(end+window_size,len(features))]),start-first,end-first
+
+# Context manager that starts the laughter analysis process pool.
+# Processes are spawned rather than forked, so that the numerical libraries
+# start with the thread limits and no model is shared with the parent.
+# Input: Number of processes.
+@contextlib.contextmanager
+def laughPool(workers):
+	threads = laughVals['threadsPerWorker'] or max(os.cpu_count()//workers,1)
+	environment = {name : os.environ.get(name) for name in THREAD_VARIABLES}
+	os.environ.update({name : str(threads) for name in THREAD_VARIABLES})
+	try:
+		with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+			mp_context=multiprocessing.get_context("spawn"),initializer=initPoolWorker,
+			initargs=(poolSettings(),threads)) as executor:
+			yield executor
+	finally:
+		for name,value in environment.items():
+			if value is None: os.environ.pop(name,None)
+			else: os.environ[name] = value
+
+# Function that returns the settings that laughter analysis processes require.
+def poolSettings():
+	return {"laughVals" : laughVals,"featureVals" : featureStore.featureVals,
+		"registryVals" : modelRegistry.registryVals,"modelPath" : modelPath}
+
+# Function that initializes a laughter analysis process.
+# Input: Dictionary returned by poolSettings, threads used by the process.
+def initPoolWorker(settings,threads):
+	global poolWorker, modelPath
+	laughVals.update(settings['laughVals'])
+	featureStore.featureVals.update(settings['featureVals'])
+	modelRegistry.registryVals.update(settings['registryVals'])
+	modelPath = settings['modelPath'] ; poolWorker = True
+	# Limiting the threads of the Tensorflow session the model is loaded into.
+	if modelEngine() == "keras":
+		import keras 								# Deep learning framework.
+		import tensorflow as tf 					# Deep neural network library
+		keras.backend.set_session(tf.compat.v1.Session(config=tf.compat.v1.ConfigProto(
+			intra_op_parallelism_threads=threads,inter_op_parallelism_threads=1)))
+
+# Function that computes the features of a block of an audio file in a
+# laughter analysis process.
+# Returns: See blockFeatures.
+def poolBlockFeatures(audioFile,start):
+	with soundfile.SoundFile(audioFile) as audio: return blockFeatures(audio,start)
+
+# Function that predicts a model batch in a laughter analysis process.
+# Input: Feature rows and frames returned by batchRows.
+# Returns: Unfiltered probability of every frame of the batch.
+def poolPredict(rows,first,last):
+	return predictLaughter(next(modelInputs(rows,batchSize=last-first,frames=slice(first,last))))
 
 
 # *** Helper functions ***
 
 # Function that extracts relevant time series features for analysis.
+# Builds the complete feature matrix, which uses ~8 GB per hour of audio.
+# laughProbabilities uses featureBatches instead.
 # Input: Time series, Series sampling rate.
 # Returns: List of features.
 def getFeatureList(timeSeries,samplingRate,window_size=37):
-	
+	mfccWindows,deltaWindows = featureWindows(timeSeries,samplingRate,window_size)
+	return numpy.hstack([mfccWindows.reshape(len(mfccWindows),-1),
+		deltaWindows.reshape(len(deltaWindows),-1)])
+
+# Function that computes the features and the window of features around every frame.
+# The windows are strided views of the zero padded features; the features are not copied.
+# Input: Time series, Series sampling rate, half window size (frames).
+# Returns: Arrays of shape (frames, 2*window_size, features) containing the
+#		   MFCC and delta feature windows of every frame.
+def featureWindows(timeSeries,samplingRate,window_size=37):
 	# Computing MFCC features.
 	mfccFeatures = computeMfccFeatures(timeSeries,samplingRate)
 	# Computing delta features.
 	deltaFeatures = computeDeltaFeatures(mfccFeatures)
-	zeroPadMFCC = numpy.zeros((window_size,mfccFeatures.shape[1]))
-	zeroPadDelta = numpy.zeros((window_size,deltaFeatures.shape[1]))
-	paddedMFCCFeatures = numpy.vstack([zeroPadMFCC,mfccFeatures,zeroPadMFCC])
-	paddedDeltaFeatures = numpy.vstack([zeroPadDelta,deltaFeatures,zeroPadDelta])
-	featureList = []
-	for i in range(window_size,len(mfccFeatures)+window_size):
-		featureList.append(formatFeatures(paddedMFCCFeatures,paddedDeltaFeatures,
-			i,window_size))
-	featureList = numpy.array(featureList)
-	return featureList
+	return (slidingWindows(mfccFeatures,window_size),
+		slidingWindows(deltaFeatures,window_size))
+
+# Function that returns a strided view of the window of rows around every row.
+# Input: 2D array, half window size.
+# Returns: Read-only array of shape (rows, 2*window_size, columns) where entry i
+#		   contains rows i-window_size to i+window_size-1, zero padded.
+def slidingWindows(features,window_size):
+	zeroPad = numpy.zeros((window_size,features.shape[1]),dtype=features.dtype)
+	padded = numpy.ascontiguousarray(numpy.vstack([zeroPad,features,zeroPad]))
+	rowStride,columnStride = padded.strides
+	return as_strided(padded,shape=(len(features),2*window_size,features.shape[1]),
+		strides=(rowStride,rowStride,columnStride),writeable=False)
+
+# Function that computes the features of every frame of a time series.
+# Input: Time series, Series sampling rate.
+# Returns: Array of shape (frames, FEATURE_COLUMNS) containing the MFCC / RMS
+#		   features followed by the delta features.
+def frameFeatures(timeSeries,samplingRate):
+	mfccFeatures = computeMfccFeatures(timeSeries,samplingRate)
+	return numpy.hstack([mfccFeatures,computeDeltaFeatures(mfccFeatures)]).astype(numpy.float32)
+
+# Function that yields the model inputs of all frames in batches.
+# Only the features of a batch and its surrounding window are read at a time,
+# so the features can be memory-mapped.
+# Input: Features returned by frameFeatures, half window size, number of
+#		 frames per batch (the model registry batch size by default), slice
+#		 of the frames (all frames by default).
+# Returns: Generator of float32 arrays of shape (frames, features).
+def modelInputs(features,window_size=37,batchSize=None,frames=slice(None)):
+	batchSize = batchSize or modelRegistry.registryVals['batchSize']
+	mfccColumns = audioFeatures.MFCC_COUNT + 1
+	frameStart,frameEnd,_ = frames.indices(len(features))
+	for start in range(frameStart,frameEnd,batchSize):
+		end = min(start+batchSize,frameEnd)
+		first = max(start-window_size,0) ; last = min(end+window_size,len(features))
+		rows = numpy.asarray(features[first:last])
+		yield next(featureBatches(
+			slidingWindows(rows[:,:mfccColumns],window_size)[start-first:end-first],
+			slidingWindows(rows[:,mfccColumns:],window_size)[start-first:end-first],end-start))
+
+# Function that yields the model inputs of consecutive frames in batches.
+# Every row has the layout used by modelInputs: the flattened MFCC window
+# followed by the flattened delta window.
+# Every frame has 2886 features, so a batch uses ~11 MB per 1000 frames.
+# Input: Windows returned by featureWindows, number of frames per batch
+#		 (the model registry batch size by default).
+# Returns: Generator of float32 arrays of shape (frames, features).
+def featureBatches(mfccWindows,deltaWindows,batchSize=None):
+	batchSize = batchSize or modelRegistry.registryVals['batchSize']
+	mfccSize = mfccWindows.shape[1]*mfccWindows.shape[2]
+	deltaSize = deltaWindows.shape[1]*deltaWindows.shape[2]
+	for start in range(0,len(mfccWindows),batchSize):
+		end = min(start+batchSize,len(mfccWindows))
+		batch = numpy.empty((end-start,mfccSize+deltaSize),dtype=numpy.float32)
+		batch[:,:mfccSize] = mfccWindows[start:end].reshape(end-start,mfccSize)
+		batch[:,mfccSize:] = deltaWindows[start:end].reshape(end-start,deltaSize)
+		yield batch
 
 
 '''
@@ -134,29 +650,17 @@ def getFeatureList(timeSeries,samplingRate,window_size=37):
 
 '''
 # Function that extracts mfcc features for the given time series.
+# The MFCC and RMS features are derived from a single spectrogram (see audioFeatures).
 # Input: Time series, Series sampling rate.
 # Returns: List of features.
 def computeMfccFeatures(timeSeries, samplingRate):
 
 	# Extractign the mel-frequency coefficients.
-	# DCT type-II transform is used and 30 frequency bins are created.
-	# Also computing a mel-sclaed spectogram.
+	# DCT type-II transform is used and 12 frequency bins are created.
 	# Hop-length is the number of samples between successive frames. / columns of a spectogram.
-	# The .T attribute is the transpose of the numpy array
-	mfccFeatures = librosa.feature.mfcc(y=timeSeries,sr=samplingRate,
-		n_mfcc=12,n_mels=12,hop_length=int(samplingRate/100),dct_type=2,n_fft=int(samplingRate/40)).T
-
-	# Separating the complex valued Spectrogram D into its magnitude and phase components.
-	# A complex valued spectogram does not have any negative frequency components.
-	complexValuedMatrix = librosa.stft(timeSeries,hop_length = int(samplingRate/100))
-	magnitude,phase = librosa.magphase(complexValuedMatrix)
-
-	# Calculating the root-mean-square value / mean of the cosing function
-	# Transposing the resultant matrix.
-	rms = librosa.feature.rmse(S=magnitude).T
-
-	# stacking the arrays horizontally and returns resultant feature list.
-	return numpy.hstack([mfccFeatures,rms])
+	# The root-mean-square value of every frame is computed from the same
+	# magnitude spectrogram and stacked horizontally with the coefficients.
+	return audioFeatures.mfccRMS(timeSeries,samplingRate)
 
 
 # Function that computes the delta features for the given time series.
@@ -167,9 +671,12 @@ def computeMfccFeatures(timeSeries, samplingRate):
 def computeDeltaFeatures(mfccFeatures):
 	return numpy.vstack([librosa.feature.delta(mfccFeatures.T),librosa.feature.delta(mfccFeatures.T, order=2)]).T
 
-# Function that formats mfcc and delta features in the correct format to use.
-def formatFeatures(mfccFeatures, deltaFeatures,index, window_size=37):
-    return numpy.append(mfccFeatures[index-window_size:index+window_size],deltaFeatures[index-window_size:index+window_size])
+# Function that returns the runs of consecutive True values of a boolean array.
+# Run boundaries are the frames where the array changes.
+# Returns: Arrays of the first index and end index (exclusive) of every run.
+def frameRuns(mask):
+	edges = numpy.flatnonzero(numpy.diff(numpy.concatenate([[0],mask.astype(numpy.int8),[0]])))
+	return edges[0::2],edges[1::2]
 
 # Applying a lowpass filter to the audio.
 def lowpass(sig, filter_order = 2, cutoff = 0.01):
@@ -185,33 +692,36 @@ def lowpass(sig, filter_order = 2, cutoff = 0.01):
 	# Once forwards, and once backwards.
 	return(signal.filtfilt(B,A, sig))
 
-# Extracts laughter from the filtered audio.
-def frame_span_to_time_span(frame_span):
-    return (frame_span[0] / 100., frame_span[1] / 100.)
-
-def collapse_to_start_and_end_frame(instance_list):
-    return (instance_list[0], instance_list[-1])
-
+# Function that extracts laughter from the filtered probabilities.
+# Laughter instances are runs of frames above the threshold that last longer
+# than the minimum length.
+# Inputs: Filtered probability of every frame, Lower bound for laugh
+#		  acceptance probability, Minimum laughter length (seconds).
+# Returns: List of (start, end) times of the first and last frame of every instance.
 def getLaughterInstances(probs, threshold = 0.5, minLength = 0.2):
-	instances = []
-	current_list = []
-	for i in range(len(probs)):
-		if numpy.min(probs[i:i+1]) > threshold:
-			current_list.append(i)
-		else:
-			if len(current_list) > 0:
-				instances.append(current_list)
-				current_list = []
-	instances = [frame_span_to_time_span(collapse_to_start_and_end_frame(i)) for i in instances if len(i) > minLength]
-	return instances
+	starts,ends = frameRuns(numpy.asarray(probs) > threshold)
+	keep = (ends-starts)/audioFeatures.FRAME_RATE > minLength
+	return list(zip((starts[keep]/audioFeatures.FRAME_RATE).tolist(),
+		((ends[keep]-1)/audioFeatures.FRAME_RATE).tolist()))
 
 # Function that transcribes laughter in the list
+# The laughter instances are inserted after the words that start at or before
+# them, as a stable sort by start time would.
 def transcribeLaugh(jsonList,instances):
-	newInst = []
-	for instance in instances: 
-		newInst.append([jsonList[1][0],instance[0],instance[1]," &=laughs "])
-	for instance in newInst:jsonList.append(instance)
-	jsonList[1:] = sorted(jsonList[1:], key = operator.itemgetter(1))
+	newInst = [transcript.Word(jsonList[1].speaker,instance[0],instance[1]," &=laughs ")
+		for instance in instances]
+	starts = numpy.fromiter((word.start for word in jsonList[1:]),dtype=float,count=len(jsonList)-1)
+	if numpy.any(starts[1:] < starts[:-1]):
+		jsonList[1:] = sorted(jsonList[1:]+newInst, key = operator.attrgetter('start'))
+		return jsonList
+	# Linear merge of the sorted words and the sorted laughter instances.
+	positions = numpy.searchsorted(starts,[instance[0] for instance in instances],side='right')
+	merged = [] ; previous = 0
+	for position,instance in zip(positions.tolist(),newInst):
+		merged.extend(jsonList[1+previous:1+position]) ; merged.append(instance)
+		previous = position
+	merged.extend(jsonList[1+previous:])
+	jsonList[1:] = merged
 	return jsonList
 
 
@@ -0,0 +1,96 @@
+'''
+    Script that stores the meta-data used for automatic post-processing.
+
+    The meta-data for every file in an output directory is stored in a hidden
+    SQLite database in that directory, indexed by the file's jsonFile.
+    Writes are atomic and can be made by several processes at the same time.
+    Meta-data in the previous .meta.json format is imported automatically.
+
+    Part of the Gailbot-3 development project.
+'''
+
+import os
+import json
+import sqlite3 									# Embedded database library.
+
+# *** Global variables / invariants ***
+
+# Hidden meta-data database for auto-post processing.
+metaDBName = ".meta.db"
+
+# Hidden meta-data file used by previous Gailbot versions.
+legacyFileName = ".meta.json"
+
+# Seconds to wait for another process to finish writing.
+lockTimeout = 30
+
+# Meta-data fields stored per file.
+metaFields = ['jsonFile','names','audioFile','individualAudioFile']
+
+
+# *** Main meta-data functions ***
+
+# Function that adds or replaces the meta-data for a list of files.
+# Replaced files keep the position they were first added at.
+# Input: List of file dictionaries.
+def addFiles(infoList):
+    groups = {}
+    for infoDic in infoList: groups.setdefault(infoDic['outputDir'],[]).append(infoDic)
+    for outputDir,group in groups.items():
+        rows = [toRow(infoDic) for infoDic in group]
+        with connect(outputDir) as connection:
+            # Files are updated in place so that they keep their position.
+            connection.executemany("UPDATE meta SET names = ?, audioFile = ?, "
+                "individualAudioFile = ? WHERE jsonFile = ?",[row[1:]+row[:1] for row in rows])
+            connection.executemany("INSERT OR IGNORE INTO meta VALUES (?,?,?,?)",rows)
+        connection.close()
+
+# Function that returns the meta-data for all files in an output directory.
+# Input: Output directory.
+# Returns: List of file dictionaries in the order they were added,
+#          or None if the directory has no meta-data.
+def files(outputDir):
+    if not os.path.exists(os.path.join(outputDir,metaDBName)) and \
+        not os.path.exists(os.path.join(outputDir,legacyFileName)): return None
+    connection = connect(outputDir)
+    rows = connection.execute("SELECT * FROM meta ORDER BY rowid").fetchall()
+    connection.close()
+    return [fromRow(row,outputDir) for row in rows]
+
+
+# *** Helper functions ***
+
+# Function that opens the meta-data database of an output directory.
+# Creates the database and imports legacy meta-data if required.
+# Returns: sqlite3 connection.
+def connect(outputDir):
+    connection = sqlite3.connect(os.path.join(outputDir,metaDBName),timeout=lockTimeout)
+    with connection:
+        connection.execute("CREATE TABLE IF NOT EXISTS meta (jsonFile TEXT PRIMARY KEY,"
+            "names TEXT, audioFile TEXT, individualAudioFile TEXT)")
+    importLegacy(outputDir,connection)
+    return connection
+
+# Function that imports a legacy .meta.json file into the database.
+# The legacy file is renamed once it has been imported.
+def importLegacy(outputDir,connection):
+    legacyPath = os.path.join(outputDir,legacyFileName)
+    try:
+        with open(legacyPath,'r') as f: dicList = json.load(f)
+    except (FileNotFoundError,ValueError): return
+    with connection:
+        connection.executemany("INSERT OR IGNORE INTO meta VALUES (?,?,?,?)",
+            [toRow(dic) for dic in dicList or []])
+    try: os.replace(legacyPath,legacyPath+".imported")
+    except FileNotFoundError: pass
+
+# Function that converts a file dictionary into a database row.
+def toRow(infoDic):
+    return (infoDic['jsonFile'],json.dumps(infoDic['names']),infoDic['audioFile'],
+        infoDic['individualAudioFile'])
+
+# Function that converts a database row into a file dictionary.
+def fromRow(row,outputDir):
+    infoDic = dict(zip(metaFields,row))
+    infoDic['names'] = json.loads(infoDic['names']) ; infoDic['outputDir'] = outputDir
+    return infoDic
@@ -0,0 +1,91 @@
+'''
+    Script that loads the models used in post-processing once per process and
+    shares them between jobs and threads.
+
+    Models are loaded lazily the first time they are used and warmed up with a
+    single prediction. Predictions are made in batches of a configurable size
+    while holding a per-model lock, and the load time and the latency of every
+    batch are recorded.
+
+    Part of the Gailbot-3 development project.
+'''
+
+import os, time
+import threading
+import numpy 									# Library to have multi-dimensional homogenous arrays.
+
+# *** Global variables / invariants ***
+
+# Dictionary containing the model registry parameters.
+registryVals = {
+    "batchSize" : 4096,         # Inputs passed to a model at a time.
+    "warmup" : True             # Runs one prediction when a model is loaded.
+}
+registryValsOriginal = registryVals.copy()
+
+# Registry entries of the models loaded by the current process.
+models = {}
+registryLock = threading.Lock()
+
+
+# *** Main registry functions ***
+
+# Function that returns a loaded model, loading it if required.
+# Input: Model name (e.g. its path), function that loads the model,
+#        function that runs one prediction to warm up the model.
+# Returns: Loaded model.
+def model(name,loader,warmup=None):
+    return entry(name,loader,warmup)['model']
+
+# Function that makes predictions with a model in batches.
+# Only one thread uses a model at a time.
+# Input: Model name, function that loads the model, function that warms up
+#        the model, array of inputs.
+# Returns: Array of outputs, one per input.
+def predict(name,loader,warmup,inputs):
+    modelEntry = entry(name,loader,warmup) ; outputs = []
+    for start in range(0,len(inputs),registryVals['batchSize']):
+        batch = inputs[start:start+registryVals['batchSize']]
+        with modelEntry['lock']:
+            startTime = time.perf_counter()
+            outputs.append(modelEntry['model'].predict(batch,batch_size=len(batch)))
+            latency = time.perf_counter() - startTime
+            modelEntry['batches'] += 1 ; modelEntry['items'] += len(batch)
+            modelEntry['batchSeconds'] += latency
+            modelEntry['maxBatchSeconds'] = max(modelEntry['maxBatchSeconds'],latency)
+    return numpy.concatenate(outputs) if len(outputs) > 0 else numpy.zeros((0,1))
+
+# Function that returns the load time and batch latency of every loaded model.
+# Returns: Dictionary mapping model names to their statistics.
+def stats():
+    with registryLock: entries = dict(models)
+    return {name : {"loadSeconds" : round(modelEntry['loadSeconds'],4),
+        "warmupSeconds" : round(modelEntry['warmupSeconds'],4),
+        "batches" : modelEntry['batches'],"items" : modelEntry['items'],
+        "meanBatchSeconds" : round(modelEntry['batchSeconds']/max(modelEntry['batches'],1),4),
+        "maxBatchSeconds" : round(modelEntry['maxBatchSeconds'],4)}
+        for name,modelEntry in entries.items()}
+
+# Function that returns a one line summary of a model's statistics.
+def summary(name):
+    modelStats = stats().get(name)
+    if modelStats is None: return "{0}: not loaded".format(name)
+    return "{0}: loaded in {1:.2f} s, {2} batches, {3:.1f} ms per batch".format(
+        os.path.basename(name),modelStats['loadSeconds']+modelStats['warmupSeconds'],
+        modelStats['batches'],1000*modelStats['meanBatchSeconds'])
+
+
+# *** Helper functions ***
+
+# Function that returns the registry entry of a model, loading it if required.
+def entry(name,loader,warmup=None):
+    with registryLock:
+        if name not in models:
+            startTime = time.perf_counter() ; loaded = loader()
+            loadSeconds = time.perf_counter() - startTime
+            if registryVals['warmup'] and warmup is not None: warmup(loaded)
+            models[name] = {"model" : loaded,"lock" : threading.Lock(),
+                "loadSeconds" : loadSeconds,
+                "warmupSeconds" : time.perf_counter() - startTime - loadSeconds,
+                "batches" : 0,"items" : 0,"batchSeconds" : 0.0,"maxBatchSeconds" : 0.0}
+        return models[name]
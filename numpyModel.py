@@ -0,0 +1,154 @@
+'''
+    Script that runs trained Keras models using NumPy only.
+
+    A model saved by Keras in Hierarchical Data Format is exported once to a
+    NumPy .npz file containing its layers and weights. The exported model is
+    then evaluated with matrix products, so that Keras and Tensorflow do not
+    have to be imported to use it. Models made of a single chain of Dense,
+    Activation, BatchNormalization and Dropout layers are supported.
+
+    Part of the Gailbot-3 development project.
+
+    Usage: python3 numpyModel.py model.h5 [model.npz]
+'''
+
+import os
+import json
+import argparse 								# Library to extract input arguments
+import numpy 									# Library to have multi-dimensional homogenous arrays.
+import scipy.special 							# Numerically stable sigmoid.
+
+# *** Global variables / invariants ***
+
+# Activation functions, as defined by Keras.
+activations = {
+    "linear" : lambda x : x,
+    "relu" : lambda x : numpy.maximum(x,0),
+    "sigmoid" : scipy.special.expit,
+    "hard_sigmoid" : lambda x : numpy.clip(0.2*x+0.5,0,1),
+    "tanh" : numpy.tanh,
+    "softplus" : lambda x : numpy.logaddexp(x,0),
+    "elu" : lambda x : numpy.where(x > 0,x,numpy.expm1(numpy.minimum(x,0))),
+    "softmax" : lambda x : scipy.special.softmax(x,axis=-1)
+}
+
+# Layers without weights that do not change their inputs at inference time.
+passLayers = ["InputLayer","Dropout","GaussianNoise","GaussianDropout","AlphaDropout"]
+
+
+# *** Main model functions ***
+
+# Function that exports a Keras model to a NumPy model file.
+# Batch normalization is stored as the scale and shift it applies.
+# Input: Path to the Keras model (.h5), path to the NumPy model (.npz).
+# Returns: List of the exported layer descriptions.
+def exportModel(h5Path,npzPath):
+    import h5py 								# Reading Hierarchical Data Format files.
+    with h5py.File(h5Path,'r') as f:
+        config = json.loads(text(f.attrs['model_config']))
+        weightGroup = f['model_weights'] if 'model_weights' in f else f
+        layers = [] ; arrays = {}
+        for layer in modelLayers(config):
+            kind = layer['class_name'] ; layerConfig = layer['config']
+            weights = layerWeights(weightGroup,layerConfig['name'])
+            if kind == "Dense":
+                index = len(layers)
+                arrays["{}/kernel".format(index)] = weights['kernel']
+                arrays["{}/bias".format(index)] = weights.get('bias',
+                    numpy.zeros(weights['kernel'].shape[1],dtype=numpy.float32))
+                layers.append({"type" : "dense","activation" : activation(layerConfig)})
+            elif kind == "BatchNormalization":
+                scale = 1/numpy.sqrt(weights['moving_variance']+layerConfig['epsilon'])
+                scale = scale*weights.get('gamma',1)
+                arrays["{}/scale".format(len(layers))] = scale.astype(numpy.float32)
+                arrays["{}/shift".format(len(layers))] = (weights.get('beta',0) -
+                    weights['moving_mean']*scale).astype(numpy.float32)
+                layers.append({"type" : "batchNormalization"})
+            elif kind == "Activation":
+                layers.append({"type" : "activation","activation" : activation(layerConfig)})
+            elif kind in passLayers or (kind == "Flatten" and len(layers) == 0): continue
+            else: raise ValueError("Unsupported layer: {0} ({1})".format(kind,layerConfig['name']))
+    numpy.savez(npzPath,layers=numpy.array(json.dumps(layers)),
+        inputShape=numpy.array(modelInputShape(config)),**arrays)
+    return layers
+
+# Class that evaluates a model exported by exportModel.
+# Predictions use float32 matrix products, so that BLAS is used.
+class NumpyModel:
+
+    def __init__(self,path):
+        with numpy.load(path) as data:
+            self.layers = json.loads(str(data['layers']))
+            self.inputShape = tuple(int(size) for size in data['inputShape'])
+            self.weights = {key : data[key] for key in data.files if "/" in key}
+        for layer in self.layers:
+            if layer.get('activation','linear') not in activations:
+                raise ValueError("Unsupported activation: {}".format(layer['activation']))
+
+    # Function that computes the model outputs.
+    # The batch size is accepted for compatibility with Keras models; all
+    # inputs are evaluated at once.
+    def predict(self,inputs,batch_size=None):
+        outputs = numpy.asarray(inputs,dtype=numpy.float32).reshape(len(inputs),-1)
+        for index,layer in enumerate(self.layers):
+            if layer['type'] == "dense":
+                outputs = outputs.dot(self.weights["{}/kernel".format(index)])
+                outputs += self.weights["{}/bias".format(index)]
+            elif layer['type'] == "batchNormalization":
+                outputs = outputs*self.weights["{}/scale".format(index)] + \
+                    self.weights["{}/shift".format(index)]
+            if 'activation' in layer: outputs = activations[layer['activation']](outputs)
+        return outputs
+
+
+# *** Helper functions ***
+
+# Function that decodes HDF5 string attributes, which may be stored as bytes.
+def text(value):
+    return value.decode('utf8') if isinstance(value,bytes) else value
+
+# Function that returns the layer configurations of a model in order.
+# Sequential models list their layers directly or under 'layers'; functional
+# models are supported if their layers form a single chain.
+def modelLayers(config):
+    layers = config['config']
+    if isinstance(layers,dict): layers = layers['layers']
+    if config['class_name'] != "Sequential":
+        for layer in layers:
+            if len(layer.get('inbound_nodes',[])) > 1 or \
+                any(len(node) > 1 for node in layer.get('inbound_nodes',[])):
+                raise ValueError("Only models with a single chain of layers are supported")
+    return layers
+
+# Function that returns the input shape of a model, without the batch dimension.
+def modelInputShape(config):
+    for layer in modelLayers(config):
+        layerConfig = layer['config']
+        for key in ['batch_input_shape','batch_shape']:
+            if key in layerConfig: return [int(size) for size in layerConfig[key][1:]]
+    raise ValueError("Model input shape not found")
+
+# Function that returns the activation of a layer configuration.
+def activation(layerConfig):
+    name = layerConfig.get('activation','linear')
+    return name if isinstance(name,str) else name['config']['name']
+
+# Function that reads the weights of a layer.
+# Returns: Dictionary mapping weight names (e.g. kernel, bias) to float32 arrays.
+def layerWeights(weightGroup,layerName):
+    if layerName not in weightGroup: return {}
+    group = weightGroup[layerName]
+    return {text(name).split('/')[-1].split(':')[0] : numpy.asarray(group[text(name)],dtype=numpy.float32)
+        for name in group.attrs.get('weight_names',[])}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Exports a Keras model to a NumPy model file')
+    parser.add_argument('model',help = 'Keras model file (.h5)')
+    parser.add_argument('output',nargs='?',default=None,
+        help = 'NumPy model file (.npz). Defaults to the model path with a .npz extension')
+    args = parser.parse_args()
+    output = args.output or os.path.splitext(args.model)[0]+".npz"
+    layers = exportModel(args.model,output)
+    print("Exported {0} layers to {1}".format(len(layers),output))
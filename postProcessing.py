@@ -13,14 +13,14 @@
     Initial development: 6/4/19	
 '''
 
-import json,csv
+import csv
 import sys, time, os
 from termcolor import colored					# Text coloring library
-import itertools								# Iterates over lists
 import inquirer 								# Selection interface library.
 from prettytable import PrettyTable				# Table printing library
 import copy 		
-import numpy 									# Library to have multi-dimensional homogenous arrays.							# Copying module.
+import concurrent.futures 						# Applying independent actions in parallel.
+import multiprocessing 							# Process start methods.
 import yaml
 
 
@@ -29,14 +29,25 @@ import CHAT										# Script to produce CHAT files.
 import rateAnalysis  							# Script to analyze speech rate.
 import laughAnalysis 							# Script to analyze laughter.
 import soundAnalysis 							# Script to analyze different sound characterists.
+import transcript 								# Script containing the transcript data model.
+import stageCache 								# Script to cache post-processing stage outputs.
+import metaStore 								# Script to store meta-data for auto-post processing.
+import columnarExport 							# Script to export transcripts in columnar formats.
+import profiling 								# Script to profile post-processing stages.
+import syllables 								# Script that counts syllables.
+import modelRegistry 							# Script that shares models between jobs.
+import featureStore 							# Script that stores audio features.
 
 
 
 
 # *** Global variables / invariants. ***
 
-# Hidden meta-data file for auto-post processing.
-metaFileName = ".meta.json"
+# Dictionary containing the post-processing parameters.
+postProcessVals = {
+    "workers" : 4           # Maximum number of worker processes. 0 uses all CPUs.
+}
+postProcessValsOriginal = postProcessVals.copy()
 
 # post-processing module dictionary
 
@@ -119,9 +130,27 @@ def inquire(modules):
 
 
 # Main menu function
+# Files in different output directories are processed in parallel by a pool
+# of worker processes. Results are collected in the order of infoList.
+# Workers are spawned rather than forked, since models and thread pools
+# loaded by earlier runs in this process cannot be safely forked.
 # Input: Tuple/List containing information.
 def postProcess(infoList):
-    processWrapper(infoList)
+    groups = groupByDirectory(infoList)
+    workers = min(postProcessVals['workers'] or os.cpu_count(),len(groups))
+    if workers <= 1: processed = [len(processWrapper(group)) for group in groups]
+    else:
+        print(colored("Post-processing {0} directories using {1} processes\n".format(
+            len(groups),workers),'blue'))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),initializer=initWorker,
+            initargs=(workerSettings(),)) as executor:
+            processed = list(executor.map(processGroup,groups))
+    if sum(processed) == 0:
+        print(colored("Post-processing not applied\nNo data to process\n",'red'))
+        # Requests from the watch-folder mode have no input and continue.
+        try: input("\nPress any key to continue...")
+        except EOFError: pass
     # Function that creates hidden file for post-processing.
     addMetaData(infoList)
 
@@ -140,6 +169,10 @@ def jsonToCSV(infoList):
         jsonList.insert(0,CSVfields)
         writer = csv.writer(open(filename, 'w'))
         writer.writerows(jsonList)
+        # Writing columnar exports.
+        infoDic['wordExports'] = []
+        if len(jsonList) > 1 and columnarExport.enabled():
+            infoDic['wordExports'] = columnarExport.exportWords(jsonList[1:],filename[:-len(".csv")])
         # Updating dictionary
         infoDic['csv'] = filename                   # Adding exit csv filename.
         infoDic['jsonList'] = jsonList				# Adding transcribed data to dictionary 
@@ -150,36 +183,167 @@ def jsonToCSV(infoList):
 
 # *** Helper functions ****
 
+# Function that groups files by output directory.
+# Files in the same output directory are part of the same conversation.
+# Returns: List of lists of file dictionaries.
+def groupByDirectory(infoList):
+    groups = {}
+    for infoDic in infoList: groups.setdefault(infoDic['outputDir'],[]).append(infoDic)
+    return list(groups.values())
+
+# Function that returns the settings that post-processing workers require.
+# Workers do not share the menu selections made in the main process.
+def workerSettings():
+    return {"CHATVals" : CHAT.CHATVals,"CHATheaders" : CHAT.CHATheaders,
+        "exportVals" : columnarExport.exportVals,"profileVals" : profiling.profileVals,
+        "syllableVals" : syllables.syllableVals,"rateVals" : rateAnalysis.rateVals,
+        "laughVals" : laughAnalysis.laughVals,"registryVals" : modelRegistry.registryVals,
+        "featureVals" : featureStore.featureVals,"processingActions" : processingActions}
+
+# Function that initializes a post-processing worker process.
+# Input: Dictionary returned by workerSettings.
+def initWorker(settings):
+    global processingActions
+    CHAT.CHATVals.update(settings['CHATVals'])
+    CHAT.CHATheaders.update(settings['CHATheaders'])
+    columnarExport.exportVals.update(settings['exportVals'])
+    profiling.profileVals.update(settings['profileVals'])
+    syllables.syllableVals.update(settings['syllableVals'])
+    rateAnalysis.rateVals.update(settings['rateVals'])
+    laughAnalysis.laughVals.update(settings['laughVals'])
+    modelRegistry.registryVals.update(settings['registryVals'])
+    featureStore.featureVals.update(settings['featureVals'])
+    # Laughter analysis runs in this process instead of starting its own processes.
+    laughAnalysis.poolWorker = True
+    processingActions = settings['processingActions']
+
+# Function that post-processes a group of files in a worker process.
+# Returns: Number of files processed.
+def processGroup(infoList):
+    return len(processWrapper(infoList))
+
 # Wrapper function that calls all processing functions
+# Profiles the run if profiling is enabled.
 # Input : List passed to main/postProcess
+# Returns: List of processed files.
 def processWrapper(infoList):
-    for action in processingActions: 
+    with profiling.run(infoList): return applyActions(infoList)
+
+# Function that applies all processing functions.
+# Actions that do not depend on each other are applied in parallel.
+# Input : List passed to main/postProcess
+# Returns: List of processed files.
+def applyActions(infoList):
+    for infoDic in infoList: infoDic['stageKeys'] = {}
+    dependencies = stageDependencies(processingActions) ; pending = []
+    for wave in stageWaves(processingActions,dependencies):
         # Ending if no files to process.
-        if len(infoList) == 0: 
-            print(colored("Post-processing not applied\nNo data to process\n",'red'))
-            input("\nPress any key to continue...")
-            return
-        else: infoList = action(infoList)
+        if len(infoList) == 0: return infoList
+        # Merging annotations before they are read.
+        if any(prev in pending for action in wave for prev in dependencies[action]):
+            mergeAnnotations(pending,infoList) ; pending = []
+        if len(wave) == 1: results = [applyStage(wave[0],infoList,dependencies[wave[0]])]
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(wave)) as executor:
+                results = list(executor.map(applyStage,wave,[infoList]*len(wave),
+                    [dependencies[action] for action in wave]))
+        # Files that are removed by any action are removed from the list.
+        for result in results:
+            kept = set(id(infoDic) for infoDic in fileDictionaries(result))
+            infoList = [infoDic for infoDic in infoList if id(infoDic) in kept]
+        pending.extend(action for action in wave if 'merge' in stageSpec(action))
+    mergeAnnotations(pending,infoList)
+    return infoList
 
-# Function that writes a meta-data file for automatic post-processing.
+# Function that returns the file dictionaries in the list returned by an action.
+# Actions return a list of dictionaries or, once files are grouped into
+# conversations, a list of lists of dictionaries.
+def fileDictionaries(result):
+    if not result: return []
+    return [infoDic for elem in result for infoDic in (elem if isinstance(elem,list) else [elem])]
+
+# Function that returns the registry entry of a post-processing action.
+# Actions that are not registered read and write the transcript.
+def stageSpec(action):
+    return stageRegistry.get(action,{"reads" : ['jsonList'],"writes" : ['jsonList']})
+
+# Function that finds the earlier actions that each action depends on.
+# An action depends on an earlier action if it reads a key that the earlier
+# action writes, or if both write the same key.
+# Annotations are merged into the transcript after the actions that produce
+# them, so annotation actions always read the transcript without them.
+# Returns: Dictionary mapping each action to a list of earlier actions.
+def stageDependencies(actions):
+    dependencies = {}
+    for pos,action in enumerate(actions):
+        spec = stageSpec(action) ; dependencies[action] = []
+        for prev in actions[:pos]:
+            prevSpec = stageSpec(prev) ; written = set(prevSpec['writes'])
+            if 'merge' not in spec: written.update(prevSpec.get('merges',[]))
+            if len(written & set(spec['reads'])) > 0 or \
+                len(set(prevSpec['writes']) & set(spec['writes'])) > 0:
+                dependencies[action].append(prev)
+    return dependencies
+
+# Function that groups consecutive independent actions.
+# Returns: List of lists of actions that can be applied in parallel.
+def stageWaves(actions,dependencies):
+    waves = []
+    for action in actions:
+        if len(waves) > 0 and not any(prev in waves[-1] for prev in dependencies[action]):
+            waves[-1].append(action)
+        else: waves.append([action])
+    return waves
+
+# Function that merges the annotations of actions into the transcript.
+# Annotations are merged in the order of processingActions.
+def mergeAnnotations(actions,infoList):
+    for action in actions:
+        with profiling.stage("merge."+action.__name__,infoList):
+            for infoDic in infoList: stageSpec(action)['merge'](infoDic)
+
+# Function that applies a single post-processing action.
+# Input : Action, List passed to main/postProcess, Actions it depends on.
+def applyStage(action,infoList,dependencies):
+    spec = stageSpec(action) ; run = spec.get('run',action)
+    with profiling.stage(action.__name__,infoList):
+        if 'params' not in spec: return run(list(infoList))
+        return cachedAction(action,run,list(infoList),dependencies)
+
+# Function that applies a post-processing action only to the files whose
+# stage output is not cached.
+# The cache key of a stage depends on the keys of the stages it depends on so
+# that a change in any stage invalidates all stages that depend on it.
+# Input : Action, function applied to files that are not cached,
+#         List passed to main/postProcess, Actions it depends on.
+def cachedAction(action,run,infoList,dependencies):
+    spec = stageSpec(action) ; misses = [] ; hits = 0
+    for infoDic in infoList:
+        infoDic['stageKeys'][action] = stageCache.stageKey(action.__module__+"."+action.__name__,
+            [infoDic['stageKeys'].get(prev) for prev in dependencies],
+            [infoDic['outputDir']+"/"+infoDic[key] for key in spec['files']],
+            spec['params'](infoDic))
+        data = stageCache.load(infoDic['outputDir'],infoDic['stageKeys'][action])
+        if data is None or not all(os.path.exists(path) for key in spec['outputs']
+            for path in (data[key] if isinstance(data[key],list) else [data[key]])):
+            misses.append(infoDic) ; continue
+        infoDic.update(data) ; hits+=1
+    if hits > 0:
+        print(colored("Using cached {0} output for {1} file(s)\n".format(action.__name__,hits),
+            'blue'),end='')
+    if len(misses) == 0: return infoList
+    # Files that are removed by the action are removed from the list.
+    processed = set(id(infoDic) for infoDic in run(misses))
+    for infoDic in misses:
+        if id(infoDic) not in processed: continue
+        stageCache.store(infoDic['outputDir'],infoDic['stageKeys'][action],
+            {key : infoDic[key] for key in spec['writes']})
+    missed = set(id(infoDic) for infoDic in misses)
+    return [infoDic for infoDic in infoList if id(infoDic) not in missed or id(infoDic) in processed]
+
+# Function that writes the meta-data for automatic post-processing.
 def addMetaData(infoList):
-    count = 0
-    for elem in infoList:
-        outDic = {} ; wrapper = {}
-        outDic['jsonFile'] = elem['jsonFile'] ; outDic['names'] = elem['names']
-        outDic['audioFile'] = elem['audioFile']
-        outDic['individualAudioFile'] = elem['individualAudioFile']
-
-        # Deleting existing instance.
-        if not os.path.exists(os.path.join(elem['outputDir'], metaFileName)):
-            with open(os.path.join(elem['outputDir'], metaFileName), 'w') as f:
-                json.dump([],f)
-        # Writing new data
-        with open(os.path.join(elem['outputDir'], metaFileName), 'r') as f: 
-            data = json.load(f)
-        if outDic not in data: data.append(outDic)
-        with open(os.path.join(elem['outputDir'], metaFileName), 'w') as f:
-            json.dump(data,f)
+    metaStore.addFiles(infoList)
 
 
 
@@ -205,42 +369,13 @@ def assignSpeakers(jsonList,namesList):
 # Function that retrieves json data from file.
 # Returns: Transcribed word List + additional metrics
 def getJSON(infoDic):
-    jsonList = []
-    labels = {}
     try:
-        with open(infoDic['outputDir'] +"/"+ infoDic['jsonFile']) as f: jsonObject = json.load(f)
+        table = transcript.readWordTable(infoDic['outputDir'] +"/"+ infoDic['jsonFile'])
     except FileNotFoundError:
         print(colored("\nERROR: File not found: {}".format(infoDic['outputDir'] +"/"+ infoDic['jsonFile']),'red'))
         return []
-    for res in jsonObject:
-        if "speaker_labels" not in res:
-            # Extracting main fields
-            try:
-                processingMetrics = res['processing_metrics']
-                resultIndex = res['result_index'];results = res['results']
-                final = results[0]['final'];wordData = results[0]['alternatives'][0]
-                # Extracting data to be written to file.
-                periodic = processingMetrics['periodic']
-                recieved = processingMetrics['processed_audio']['received']
-                confidenceVals = wordData['word_confidence'];words = wordData['timestamps']
-                # Writing row per word.
-                if final:
-                    for word,confidence in itertools.zip_longest(words,confidenceVals):
-                            # Extracting transcript and timing
-                            trans = word[0];startTime = word[1]
-                            endTime = word[2];confVal = confidence[1]
-                            jsonList.append([startTime,endTime,trans,confVal,
-                                periodic,recieved,resultIndex])
-            except KeyError: continue
-        else:
-            speakerLabels = res['speaker_labels']
-            for label in speakerLabels: labels.update({label['from']:label['speaker']})
-    # Adding speaker labels to output list
-    for listElem,label in zip(jsonList,labels): listElem.insert(0,labels[label])
-    # Adding label if no speaker labels were returned.
-    if len(labels) == 0: 
-        labels = numpy.resize([0,1],len(jsonList))
-        for elem,label in zip(jsonList,labels):elem.insert(0,label)
+    # Writing record per word with its speaker label.
+    jsonList = table.records(table.speakers().tolist())
     # Changing labels to provided names
     jsonList = assignSpeakers(jsonList,infoDic['names'])
     return jsonList
@@ -250,6 +385,56 @@ processingActions = [jsonToCSV,rateAnalysis.analyzeSyllableRate,
         laughAnalysis.analyzeLaugh,#soundAnalysis.analyzeSound,
         CHAT.formatCHAT]
 
+# Registry of the post-processing actions.
+# reads : Keys of the file dictionary used by the action.
+# writes : Keys of the file dictionary added / changed by the action.
+# run : Function applied instead of the action. Defaults to the action.
+# merge : Function that merges the annotations written by the action into the
+#         transcript. Annotations are merged in the order of processingActions
+#         once they are read by a later action, and annotations that change
+#         words must be merged before annotations that add words.
+# merges : Keys changed by the merge function.
+# Actions with the following entries are cached (see stageCache):
+# files : Keys of the input files used by the action.
+# params : Function returning the parameters used by the action.
+# outputs : Keys of files (or lists of files) written by the action that must
+#           exist on a cache hit.
+stageRegistry = {
+    jsonToCSV : {
+        "reads" : ['jsonFile','names'],
+        "writes" : ['jsonList','csv','wordExports'],
+        "files" : ['jsonFile'],
+        "params" : lambda infoDic : {"names" : infoDic['names'],"fields" : CSVfields,
+            "exports" : columnarExport.exportVals['formats'] if columnarExport.enabled() else []},
+        "outputs" : ['csv','wordExports']},
+    rateAnalysis.analyzeSyllableRate : {
+        "reads" : ['jsonList'],
+        "writes" : ['rateAnnotations'],
+        "run" : rateAnalysis.rateAnnotations,
+        "merge" : rateAnalysis.applyRateAnnotations,
+        "merges" : ['jsonList'],
+        "files" : [],
+        "params" : lambda infoDic : {"limitDeviations" : rateAnalysis.LimitDeviations,
+            "turnEndThreshold" : CHAT.CHATVals['turnEndThreshold'],
+            "delims" : rateAnalysis.delims,"rateVals" : rateAnalysis.rateVals},
+        "outputs" : []},
+    laughAnalysis.analyzeLaugh : {
+        "reads" : ['jsonList','individualAudioFile'],
+        "writes" : ['laughInstances'],
+        "run" : laughAnalysis.laughInstances,
+        "merge" : laughAnalysis.applyLaughInstances,
+        "merges" : ['jsonList'],
+        "files" : ['individualAudioFile'],
+        "params" : lambda infoDic : {"model" : laughAnalysis.modelDigest(),
+            "sampleRate" : laughAnalysis.AUDIO_SAMPLE_RATE,"laughVals" : laughAnalysis.laughParameters(),
+            "threshold" : CHAT.CHATVals['lowerBoundLaughAcceptance'],
+            "minSeconds" : CHAT.CHATVals['LowerBoundLaughLength']},
+        "outputs" : []},
+    CHAT.formatCHAT : {
+        "reads" : ['jsonList','names','audioFile'],
+        "writes" : ['CHAT']}
+}
+
 # List of functions to implement
 #processingActions = [jsonToCSV,soundAnalysis.analyzeSound,CHAT.formatCHAT]
 
@@ -388,15 +573,10 @@ def get_val(dic,key,type):
 # Function that reads metadata file to add fileds automatically for post-processing
 # Returns True of data found and false if not found.
 def retrieveMetaData(outputDir):
-    if os.path.exists(os.path.join(outputDir,metaFileName)):
-        with open(os.path.join(outputDir,metaFileName), 'r') as stream:
-            dicList = json.load(stream)
-            if dicList == None: return False
-            for dic in dicList:
-                dic['outputDir'] = outputDir
-                infoList.append(dic)
-        return True
-    else: return False
+    dicList = metaStore.files(outputDir)
+    if dicList == None: return False
+    infoList.extend(dicList)
+    return True
     
 
 # Function that gets the remaining inputs for post-processing
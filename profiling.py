@@ -0,0 +1,132 @@
+'''
+    Script that profiles the post-processing stages.
+
+    Records the wall time, CPU time, CPU time of child processes, peak RSS
+    increase and number of items per file of every stage and writes a JSON
+    profile per post-processing run to the output directory, together with
+    the load time and batch latency of the models used.
+    Optionally captures a cProfile or pyinstrument profile of the whole run.
+
+    Part of the Gailbot-3 development project.
+'''
+
+import os, sys, time
+import json
+import resource 								# Process resource usage.
+import threading
+import contextlib
+import cProfile 								# Deterministic function profiler.
+from termcolor import colored					# Text coloring library
+
+# Gailbot scripts
+import modelRegistry 							# Models shared by post-processing jobs.
+
+# *** Global variables / invariants ***
+
+# Dictionary containing the profiling parameters.
+profileVals = {
+    "enabled" : False,      # Writes a JSON profile per run.
+    "capture" : ""          # Additional profile of the whole run: cProfile / pyinstrument
+}
+profileValsOriginal = profileVals.copy()
+
+# Hidden directory created in the output directory for the profiles.
+profileDirName = ".profiles"
+
+# ru_maxrss is reported in kilobytes on Linux and in bytes on macOS.
+rssScale = 1 if sys.platform == 'darwin' else 1024
+
+# Stage records of the current run.
+records = []
+recordsLock = threading.Lock()
+
+
+# *** Main profiling functions ***
+
+# Context manager that profiles a post-processing run and writes its profile.
+# Input: List of file dictionaries processed in the run.
+@contextlib.contextmanager
+def run(infoList):
+    if not profileVals['enabled'] or len(infoList) == 0: yield ; return
+    outputDir = infoList[0]['outputDir'] ; runId = time.strftime("%Y%m%d-%H%M%S")
+    runName = os.path.join(outputDir,profileDirName,"{0}-{1}".format(runId,os.getpid()))
+    profiler = startCapture()
+    del records[:]
+    start = time.perf_counter()
+    try: yield
+    finally:
+        wallTime = time.perf_counter() - start
+        os.makedirs(os.path.dirname(runName),exist_ok=True)
+        stopCapture(profiler,runName)
+        profile = {"run" : runId,"pid" : os.getpid(),"outputDir" : outputDir,
+            "files" : [infoDic['jsonFile'] for infoDic in infoList],
+            "wallSeconds" : round(wallTime,4),"stages" : list(records),
+            "models" : modelRegistry.stats()}
+        with open(runName+".json",'w') as f: json.dump(profile,f,indent=2)
+
+# Context manager that records the resources used by a single stage.
+# Input: Stage name, file dictionaries or lists of file dictionaries
+#        processed by the stage.
+@contextlib.contextmanager
+def stage(name,infoList):
+    if not profileVals['enabled']: yield ; return
+    before = usage()
+    try: yield
+    finally:
+        after = usage()
+        record = {"stage" : name,"thread" : threading.current_thread().name}
+        for key in before: record[key] = round(after[key]-before[key],4)
+        record['peakRSSDeltaMB'] = round(record.pop('peakRSS')*rssScale/(1<<20),2)
+        record['items'] = {infoDic['jsonFile'] : itemCount(infoDic) for infoDic in files(infoList)}
+        with recordsLock: records.append(record)
+
+
+# *** Helper functions ***
+
+# Function that returns the current resource usage of the process.
+# Returns: Dictionary containing the wall time, CPU time of the process and
+#          its threads, CPU time of the current thread, CPU time of child
+#          processes and the peak RSS.
+def usage():
+    selfUsage = resource.getrusage(resource.RUSAGE_SELF)
+    childUsage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {"wallSeconds" : time.perf_counter(),
+        "cpuSeconds" : selfUsage.ru_utime + selfUsage.ru_stime,
+        "threadCpuSeconds" : time.thread_time(),
+        "childCpuSeconds" : childUsage.ru_utime + childUsage.ru_stime,
+        "peakRSS" : selfUsage.ru_maxrss}
+
+# Function that returns the file dictionaries in a list that may contain
+# lists of file dictionaries grouped by conversation.
+def files(infoList):
+    return [infoDic for elem in infoList for infoDic in (elem if isinstance(elem,list) else [elem])]
+
+# Function that returns the number of transcript items of a file.
+# Uses the combined turns once they are available, the words otherwise.
+def itemCount(infoDic):
+    for key in ['jsonListCombined','jsonList']:
+        if key in infoDic: return len(infoDic[key])
+    return 0
+
+# Function that starts the selected capture profiler.
+# Returns: Started profiler, or None.
+def startCapture():
+    if profileVals['capture'] == "cProfile":
+        profiler = cProfile.Profile() ; profiler.enable() ; return profiler
+    if profileVals['capture'] == "pyinstrument":
+        try: from pyinstrument import Profiler
+        except ImportError:
+            print(colored("WARNING: pyinstrument is not installed. Capture skipped",'red'))
+            return None
+        profiler = Profiler() ; profiler.start() ; return profiler
+    return None
+
+# Function that stops the capture profiler and writes its output.
+# Input: Profiler returned by startCapture, output path without extension.
+def stopCapture(profiler,runName):
+    if profiler is None: return
+    if isinstance(profiler,cProfile.Profile):
+        profiler.disable() ; profiler.dump_stats(runName+".prof")
+    else:
+        profiler.stop()
+        with open(runName+".html",'w') as f: f.write(profiler.output_html())
@@ -26,16 +26,17 @@
 '''
 
 import os, sys
+import heapq 									# Heaps used by the rolling median.
+import collections
 import librosa.display 						# Library to display signal.
 import numpy 									# Library to have multi-dimensional homogenous arrays.
-from big_phoney import BigPhoney				# Finds the syllables per word.
 from statsmodels import robust 					# Statistics library.
-import tensorflow as tf 						# Deep neural network library
-import operator									# Sorting library
-import copy 									# Copying module.
-import logging
 from termcolor import colored
 
+# Gailbot scripts
+import profiling 								# Post-processing stage profiling.
+import syllables 								# Syllable counting service.
+
 
 import matplotlib.pyplot as plt 				# Library to visualize mfcc features.
 from matplotlib.font_manager import FontProperties
@@ -43,8 +44,6 @@ from matplotlib.font_manager import FontProperties
 plt.style.use('seaborn') # pretty matplotlib plots
 
 
-tf.get_logger().setLevel(logging.ERROR) 		# Turning off tensorflow debugging messages.
-
 # *** Global variables / invariants ***
 
 
@@ -57,109 +56,151 @@ delims = {
 	"fastSpeech" :  u'\u2206'
 }
 
+# Translation table removing period markers from turn text.
+periodMarkers = {ord('.'):None}
+
+# Dictionary containing the speech rate statistics parameters.
+rateVals = {
+	"perSpeaker" : False, 		# Separate median / MAD for every speaker.
+	"window" : 0, 				# Turns in the rolling median / MAD window, 0 for the whole file.
+	"revisionWindow" : 20 		# Closed turns re-annotated by the streaming analyzer.
+}
+rateValsOriginal = rateVals.copy()
+
+# Scale factor making the MAD a consistent estimator of the standard deviation,
+# as used by statsmodels.robust.mad.
+MADScale = 0.6744897501960817
+
 # *** Definitions for speech rate analysis functions ***
 
 # Main driver function
 def analyzeSyllableRate(infoList):
-	# Importing the construct turn function here to avoid circular dependancies.
-	from CHAT import constructTurn
-	# Copying original list so it is not modified.
-	infoListCopy = copy.deepcopy(infoList)
-	# Removing hesitation markers from list
-	infoListCopy = removeHesitation(infoListCopy)
-	# Constructing turns for all files in infoList.
-	infoListCopy = constructTurn(infoListCopy)
+	infoList = rateAnnotations(infoList)
+	for dic in infoList: applyRateAnnotations(dic)
+	return infoList
+
+# Function that finds the slow / fast speech delimiters for every file without
+# changing the transcript.
+# Turns are represented as ranges of word indices in dic['jsonList'], so that
+# neither the words nor the turns are copied.
+# Adds dic['rateAnnotations']: Dictionary mapping the index of a word in
+# dic['jsonList'] to its annotated text.
+def rateAnnotations(infoList):
+	# Importing the CHAT values here to avoid circular dependancies.
+	from CHAT import CHATVals
 	print(colored("\nAnalyzing syllable rate...\n",'blue'))
-	for dic in infoListCopy:
+	for dic in infoList:
 		print("Loading file: {0}".format(dic['outputDir']+"/"+dic['jsonFile']))
+		jsonList = dic['jsonList']
+		# Indices of the words analyzed, excluding the header and hesitation markers.
+		positions = numpy.fromiter((pos for pos in range(1,len(jsonList))
+			if jsonList[pos].text != "%HESITATION"),dtype=numpy.int64)
+		# Word text without period markers, as used in the turns.
+		texts = [periodless(jsonList[pos].text) for pos in positions]
+		turnStarts,turnEnds = turnRanges(jsonList,positions,CHATVals['turnEndThreshold'])
 		# Finding the syllable rate.
-		dictionaryList = findSyllables(dic['jsonListTurns'])
+		with profiling.stage("rateAnalysis.findSyllables",[dic]):
+			rates = turnRates(jsonList,positions,texts,turnStarts,turnEnds)
 		# Getting stats values.
-		statsDic = stats(dictionaryList)
-		# Adding slow / fast speech delims to the transcript.
-		# Adds delims to individual word jsonList.
-		dic['jsonList'] = addDelims(dictionaryList,statsDic,dic['jsonList'])
-		# Visuzlizing the data.
-		# ** visualize(dictionaryList)
-	for dicCopy,dic in zip(infoListCopy,infoList):
-		# Adding Hesitation markers back.
-		dic['jsonList'] = addHesitation(dicCopy,dic)
+		rateStats = RateStats(rates,[jsonList[positions[pos]].speaker for pos in turnStarts])
+		# Finding the slow / fast speech delims for individual words.
+		addDelims(texts,turnStarts,turnEnds,rateStats)
+		dic['rateAnnotations'] = {int(pos) : text for pos,text in zip(positions,texts)
+			if text != jsonList[pos].text}
 	print(colored("Syllable rate analysis completed\n",'green'))
 	return infoList
 
+# Function that adds the slow / fast speech delimiters found by rateAnnotations
+# to the transcript.
+# Must be applied before words are added to or removed from dic['jsonList'].
+def applyRateAnnotations(dic):
+	jsonList = dic['jsonList']
+	for pos,word in dic['rateAnnotations'].items(): jsonList[pos].text = word
+	return dic
+
 # *** Helper functions for speech rate analysis ***
 
 # Function that returns a dictionary including the element, syllables per turn,
 # and the syllable rate of the turn
+# Turns without a duration have an undefined (nan) rate.
 # Returns: A list of dictionaries where each dictionary contains data for one turn.
 def findSyllables(jsonListTurns):
 	dictionaryList = []
-	phoney = BigPhoney()
-	for elem in jsonListTurns:
-		syllableNum = sum([phoney.count_syllables(word) for word in elem[3].split()])
+	turnWords = [elem.text.split() for elem in jsonListTurns]
+	# Counting the syllables of all words at once.
+	wordCounts = iter(syllables.counts([word for words in turnWords for word in words]))
+	for elem,words in zip(jsonListTurns,turnWords):
+		syllableNum = sum(next(wordCounts) for word in words)
+		duration = abs(elem.end-elem.start)
 		dictionaryList.append({"elem" : elem, "syllableNum" : syllableNum,
-			"syllRate" : round(syllableNum/(abs(elem[2]-elem[1])),2)})
+			"syllRate" : round(syllableNum/duration,2) if duration > 0 else numpy.nan})
 	return dictionaryList
 
-# Function that calculates the different stats values needed.
-# Input: A list of dictionaries where each dictionary contains data for one turn.
-# Returns: Dictionary containing the median, median absoulte deviation, 
-# upperLimit, and lowerLimit
-def stats(dictionaryList):
-	allRates = []
-	for dic in dictionaryList:
-		allRates.append(dic['syllRate'])
-	allRates = numpy.sort(numpy.array(allRates))
-	median = numpy.median(allRates)
-	median_absolute_deviation = round(robust.mad(allRates),2)
-	lowerLimit = (median-(LimitDeviations*median_absolute_deviation))
-	upperLimit = (median+(LimitDeviations*median_absolute_deviation))
-	return {"median" : median, "medianAbsDev" : median_absolute_deviation,
-		"upperLimit" : upperLimit, "lowerLimit" : lowerLimit}
-
-
-
-# Function that adds fast / slow speech delimiters to the transcript
-def addDelims(dictionaryList,statsDic,jsonList):
+# Function that finds the turns of a file as ranges of word indices.
+# Consecutive words form a turn if they have the same speaker and the silence
+# between them is at most turnEndThreshold, as in CHAT.constructTurn.
+# Input: jsonList, indices of the words used, turnEndThreshold.
+# Returns: Arrays containing the first and one past the last position of every turn.
+def turnRanges(jsonList,positions,turnEndThreshold):
+	if len(positions) == 0: return numpy.zeros(0,dtype=int),numpy.zeros(0,dtype=int)
+	speakers = numpy.array([jsonList[pos].speaker for pos in positions],dtype=object)
+	starts = numpy.array([jsonList[pos].start for pos in positions],dtype=float)
+	ends = numpy.array([jsonList[pos].end for pos in positions],dtype=float)
+	newTurn = numpy.ones(len(positions),dtype=bool)
+	newTurn[1:] = (speakers[1:] != speakers[:-1]) | (starts[1:] - ends[:-1] > turnEndThreshold)
+	turnStarts = numpy.flatnonzero(newTurn)
+	return turnStarts,numpy.append(turnStarts[1:],len(positions))
+
+# Function that finds the syllable rate of every turn.
+# Input: jsonList, indices of the words used, word text,
+#		 turn ranges returned by turnRanges.
+# Returns: Array containing the syllable rate of every turn.
+def turnRates(jsonList,positions,texts,turnStarts,turnEnds):
+	if len(turnStarts) == 0: return numpy.zeros(0)
+	# Counting the syllables of all words at once.
+	wordSyllables = numpy.array(syllables.counts(texts),dtype=float)
+	syllableNum = numpy.add.reduceat(wordSyllables,turnStarts)
+	start = numpy.array([jsonList[positions[pos]].start for pos in turnStarts],dtype=float)
+	end = numpy.array([jsonList[positions[pos-1]].end for pos in turnEnds],dtype=float)
+	with numpy.errstate(divide='ignore',invalid='ignore'):
+		return numpy.round(syllableNum/numpy.abs(end-start),2)
+
+# Function that adds fast / slow speech delimiters to the first and last word
+# of every slow / fast turn.
+# Input: Word text, modified in place, turn ranges returned by turnRanges,
+#		 RateStats of the turns.
+def addDelims(texts,turnStarts,turnEnds,rateStats):
+	slow = rateStats.slow() ; fast = rateStats.fast()
+	for turn in numpy.flatnonzero(slow | fast):
+		delimitTurn(texts,turnStarts[turn],turnEnds[turn]-1,slow[turn],rateStats.rates[turn],
+			rateStats.median[turn],rateStats.medianAbsDev[turn])
+	print("Fast turns found: {0}\nSlow turns found: {1}\n".format(
+		numpy.count_nonzero(fast),numpy.count_nonzero(slow)))
+	return texts
+
+
+# Function that adds the slow / fast speech delimiters to a single turn.
+# Input: Word text, modified in place, first and last position of the turn,
+#		 whether the turn is slow (fast otherwise), syllable rate, median and
+#		 MAD of the turn.
+def delimitTurn(texts,first,last,slow,rate,median,medianAbsDev):
 	vowels = ['a','e','i','o','u']
-	jsonListTurns = [] ; words = [] ; fastCount = 0 ; slowCount = 0
-	for elem in dictionaryList:
-		if elem['syllRate'] <= statsDic['lowerLimit']:
-			# For one word, adding colons to trailing vowel.
-			if len(elem['elem'][3].split())==1 and any(char in vowels for char in elem['elem'][3]):
-				pos = lastVowelPos(elem['elem'][3])
-				colons = numColons(statsDic['medianAbsDev'],elem['syllRate'], statsDic['median'])
-				elem['elem'][3] = elem['elem'][3][:pos+1] + (":"*colons) + elem['elem'][3][pos+1:]
-			else:
-				elem['elem'][3] = delims['slowSpeech'] + elem['elem'][3] + delims['slowSpeech']
-			slowCount+=1
-		elif elem['syllRate'] >= statsDic['upperLimit']: 
-			elem['elem'][3] = delims['fastSpeech'] + elem['elem'][3] + delims['fastSpeech']
-			fastCount+=1
-		jsonListTurns.append(elem['elem'])
-	print("Fast turns found: {0}\nSlow turns found: {1}\n".format(fastCount,slowCount))
-	for elem in jsonListTurns:
-		for word in elem[3].split():words.append(word)
-	for word,elem in zip(words,jsonList[1:]): elem[3] = str(word)
-	return jsonList
-
-
-# Function that removes hesitation markers from jsonList
-def removeHesitation(infoList):
-	for dic in infoList:
-		dic['jsonList'] = [elem for elem in dic['jsonList'] if elem[3] != "%HESITATION"]
-	return infoList
-
-# Function that adds hesitation markers back
-# Input: Two dictionaries in infoList.
-# Returns: jsonList
-def addHesitation(dicCopy,dic):
-	jsonList = []
-	for elem in dicCopy['jsonList']:jsonList.append(elem)
-	for elem in dic['jsonList']:
-		if elem[3] == "%HESITATION":jsonList.append(elem)
-	jsonList[1:] = sorted(jsonList[1:], key = operator.itemgetter(1))
-	return jsonList
+	text = texts[first]
+	if not slow:
+		texts[first] = delims['fastSpeech'] + texts[first]
+		texts[last] = texts[last] + delims['fastSpeech']
+	# For one word, adding colons to trailing vowel.
+	elif first == last and len(text.split())==1 and any(char in vowels for char in text):
+		pos = lastVowelPos(text)
+		colons = numColons(medianAbsDev,rate,median)
+		texts[first] = text[:pos+1] + (":"*colons) + text[pos+1:]
+	else:
+		texts[first] = delims['slowSpeech'] + texts[first]
+		texts[last] = texts[last] + delims['slowSpeech']
+
+# Function that removes period markers from a word.
+def periodless(text):
+	return text.translate(periodMarkers) if '.' in text else text
 
 # Function that finds the last vowel in a string
 def lastVowelPos(string):
@@ -178,11 +219,246 @@ def numColons(syllRateMAD, syllRateTurn,median):
 	syllRateDiff = abs(syllRateTurn - median)
 	# Handling case where difference is 0 i.e. denominator cannot be 0.
 	if syllRateDiff == 0: syllRateDiff = 0.1
+	# Handling case where all rates in the baseline are equal.
+	if syllRateMAD == 0: syllRateMAD = 0.01
 	colons = int(round(syllRateDiff/ syllRateMAD))
 	return colons
 
 
 
+# *** Speech rate statistics ***
+
+# Class containing the median / MAD baseline of every turn, computed either
+# for the whole file or per speaker, over all turns or a rolling window of
+# rateVals['window'] turns.
+# The rolling MAD is the rolling median of the absolute deviations from the
+# rolling median, so that both are computed in O(n log window).
+# Input: Syllable rates of the turns, speakers of the turns.
+class RateStats:
+
+	def __init__(self,rates,speakers=None):
+		self.rates = numpy.asarray(rates,dtype=float)
+		# Turns without a baseline, such as turns without a duration, are
+		# neither slow nor fast.
+		self.median = numpy.full(len(self.rates),numpy.nan)
+		self.medianAbsDev = numpy.full(len(self.rates),numpy.nan)
+		groups = {}
+		if rateVals['perSpeaker'] and speakers is not None:
+			for turn,speaker in enumerate(speakers): groups.setdefault(speaker,[]).append(turn)
+		else: groups[None] = range(len(self.rates))
+		for turns in groups.values():
+			# Rates of turns without a duration are infinite or undefined.
+			turns = numpy.asarray(turns,dtype=int)
+			turns = turns[numpy.isfinite(self.rates[turns])]
+			if len(turns) == 0: continue
+			self.median[turns],self.medianAbsDev[turns] = baseline(self.rates[turns],
+				rateVals['window'])
+		self.lowerLimit = self.median-(LimitDeviations*self.medianAbsDev)
+		self.upperLimit = self.median+(LimitDeviations*self.medianAbsDev)
+
+	# Median syllable rate of all turns with a finite rate, nan if there are none.
+	def fileMedian(self):
+		rates = self.rates[numpy.isfinite(self.rates)]
+		return numpy.median(rates) if len(rates) > 0 else numpy.nan
+
+	# Returns: Boolean array marking the slow turns.
+	def slow(self):
+		return self.rates <= self.lowerLimit
+
+	# Returns: Boolean array marking the fast turns.
+	def fast(self):
+		return ~self.slow() & (self.rates >= self.upperLimit)
+
+# Class that maintains the median of a sliding window of values in two heaps.
+# Values are added with increasing indices and removed oldest first; removed
+# values are deleted lazily once they reach the top of a heap.
+class SlidingMedian:
+
+	def __init__(self):
+		self.low = [] ; self.high = [] 		# Max-heap of the lower half, min-heap of the upper half.
+		self.sizes = [0,0] 					# Values in the window in each heap.
+		self.start = 0 						# Index of the oldest value in the window.
+
+	def __len__(self):
+		return self.sizes[0] + self.sizes[1]
+
+	# Function that adds the value with the next index to the window.
+	def add(self,index,value):
+		if self.sizes[0] > 0 and (value,index) <= self.top(self.low):
+			heapq.heappush(self.low,(-value,-index)) ; self.sizes[0] += 1
+		else: heapq.heappush(self.high,(value,index)) ; self.sizes[1] += 1
+		self.balance()
+
+	# Function that removes the oldest value from the window.
+	def remove(self,index,value):
+		self.prune()
+		if self.sizes[0] > 0 and (value,index) <= self.top(self.low): self.sizes[0] -= 1
+		else: self.sizes[1] -= 1
+		self.start = index + 1
+		self.balance()
+
+	# Returns: Median of the values in the window, nan if it is empty.
+	def median(self):
+		if len(self) == 0: return numpy.nan
+		if self.sizes[0] > self.sizes[1]: return self.top(self.low)[0]
+		return (self.top(self.low)[0] + self.top(self.high)[0]) / 2
+
+	# Function that returns the (value, index) at the top of a heap.
+	def top(self,heap):
+		self.prune()
+		return (-heap[0][0],-heap[0][1]) if heap is self.low else heap[0]
+
+	# Function that deletes removed values from the top of both heaps.
+	def prune(self):
+		while len(self.low) > 0 and -self.low[0][1] < self.start: heapq.heappop(self.low)
+		while len(self.high) > 0 and self.high[0][1] < self.start: heapq.heappop(self.high)
+
+	# Function that moves values between the heaps so that the lower half
+	# contains as many values as the upper half, or one more.
+	def balance(self):
+		while self.sizes[0] > self.sizes[1] + 1:
+			value,index = self.top(self.low) ; heapq.heappop(self.low)
+			heapq.heappush(self.high,(value,index))
+			self.sizes[0] -= 1 ; self.sizes[1] += 1
+		while self.sizes[1] > self.sizes[0]:
+			value,index = self.top(self.high) ; heapq.heappop(self.high)
+			heapq.heappush(self.low,(-value,-index))
+			self.sizes[1] -= 1 ; self.sizes[0] += 1
+
+# Class that maintains a running median / MAD baseline of the turns seen so
+# far, or of the last rateVals['window'] turns.
+# The MAD is approximated as the median of the absolute deviation of every
+# rate from the median at the time it was added.
+class RunningBaseline:
+
+	def __init__(self,window):
+		self.window = window
+		self.rates = SlidingMedian() ; self.deviations = SlidingMedian()
+		self.recent = collections.deque() 	# Rates and deviations in the window.
+		self.count = 0
+
+	# Function that adds the syllable rate of a turn to the baseline.
+	def add(self,rate):
+		self.rates.add(self.count,rate)
+		deviation = abs(rate - self.rates.median())
+		self.deviations.add(self.count,deviation)
+		self.count += 1
+		if self.window <= 0: return
+		self.recent.append((rate,deviation))
+		if len(self.recent) > self.window:
+			index = self.count - len(self.recent) ; oldRate,oldDeviation = self.recent.popleft()
+			self.rates.remove(index,oldRate) ; self.deviations.remove(index,oldDeviation)
+
+	# Returns: Current median and MAD.
+	def values(self):
+		return self.rates.median(),round(self.deviations.median()/MADScale,2)
+
+# Function that finds the median / MAD baseline of a sequence of rates.
+# Input: Syllable rates, number of turns in the rolling window (0 for all turns).
+# Returns: Arrays containing the median and MAD used for every rate.
+def baseline(rates,window):
+	if window <= 0 or window >= len(rates):
+		median = numpy.median(rates)
+		medianAbsDev = round(robust.mad(numpy.sort(rates)),2)
+		return numpy.full(len(rates),median),numpy.full(len(rates),medianAbsDev)
+	median = rollingMedian(rates,window)
+	medianAbsDev = numpy.round(rollingMedian(numpy.abs(rates-median),window)/MADScale,2)
+	return median,medianAbsDev
+
+# Function that finds the median of a centered window around every value.
+# Windows are truncated at both ends of the sequence.
+# Input: Values, number of values in the window.
+# Returns: Array containing the median of every window.
+def rollingMedian(values,window):
+	half = int(window)//2 ; values = numpy.asarray(values,dtype=float).tolist()
+	medians = numpy.empty(len(values)) ; window = SlidingMedian()
+	for index in range(min(half,len(values))): window.add(index,values[index])
+	for index in range(len(values)):
+		if index + half < len(values): window.add(index+half,values[index+half])
+		if index - half > 0: window.remove(index-half-1,values[index-half-1])
+		medians[index] = window.median()
+	return medians
+
+
+# *** Streaming speech rate analysis ***
+
+# Class that annotates slow / fast turns while a transcript is being received.
+# Words are added in order and grouped into turns as in rateAnnotations. When
+# a turn closes, its syllable rate is added to a running baseline and the
+# turn is annotated using the current median / MAD. The last
+# rateVals['revisionWindow'] closed turns are re-annotated whenever the
+# baseline changes; older turns are final and are no longer stored.
+# Input: Silence (seconds) after which the same speaker starts a new turn.
+class StreamingRateAnalyzer:
+
+	def __init__(self,turnEndThreshold):
+		self.turnEndThreshold = turnEndThreshold
+		self.baselines = {} 					# Running baseline per speaker, or for all turns.
+		self.turns = collections.deque() 		# Closed turns that can still be revised.
+		self.openTurn = None
+		self.count = 0 							# Number of words added.
+
+	# Function that adds words to the transcript.
+	# Input: List of word records, in order.
+	# Returns: Dictionary mapping the index of every word (in the order added)
+	#		   whose annotated text changed to its annotated text.
+	def addWords(self,words):
+		updates = {}
+		# Hesitation markers are not part of any turn and are not counted.
+		counts = iter(syllables.counts([periodless(word.text) for word in words
+			if word.text != "%HESITATION"]))
+		for word in words:
+			index = self.count ; self.count += 1
+			if word.text == "%HESITATION": continue
+			syllableNum = next(counts)
+			turn = self.openTurn
+			if turn is not None and (word.speaker != turn['speaker'] or
+				word.start - turn['end'] > self.turnEndThreshold):
+				updates.update(self.closeTurn())
+				turn = None
+			if turn is None:
+				turn = self.openTurn = {"speaker" : word.speaker,"start" : word.start,
+					"indices" : [],"words" : [],"texts" : [],"syllableNum" : 0,"annotated" : None}
+			turn['indices'].append(index) ; turn['words'].append(word.text)
+			turn['texts'].append(periodless(word.text))
+			turn['end'] = word.end ; turn['syllableNum'] += syllableNum
+		return updates
+
+	# Function that closes the current turn, e.g. at the end of the transcript.
+	# Returns: Dictionary of changed annotations, as returned by addWords.
+	def flush(self):
+		return self.closeTurn()
+
+	# Function that closes the open turn and revises the recent turns.
+	def closeTurn(self):
+		turn = self.openTurn ; self.openTurn = None
+		if turn is None: return {}
+		with numpy.errstate(divide='ignore',invalid='ignore'):
+			turn['rate'] = round(float(numpy.float64(turn['syllableNum'])/
+				abs(turn['end']-turn['start'])),2)
+		key = turn['speaker'] if rateVals['perSpeaker'] else None
+		if key not in self.baselines: self.baselines[key] = RunningBaseline(rateVals['window'])
+		if numpy.isfinite(turn['rate']): self.baselines[key].add(turn['rate'])
+		self.turns.append(turn)
+		updates = {}
+		for recent in self.turns: updates.update(self.annotate(recent))
+		while len(self.turns) > max(rateVals['revisionWindow'],1): self.turns.popleft()
+		return updates
+
+	# Function that annotates a turn using the current baseline of its speaker.
+	# Returns: Dictionary of the changed annotations of the turn.
+	def annotate(self,turn):
+		key = turn['speaker'] if rateVals['perSpeaker'] else None
+		median,medianAbsDev = self.baselines[key].values()
+		texts = list(turn['texts'])
+		slow = turn['rate'] <= median-(LimitDeviations*medianAbsDev)
+		if slow or turn['rate'] >= median+(LimitDeviations*medianAbsDev):
+			delimitTurn(texts,0,len(texts)-1,slow,turn['rate'],median,medianAbsDev)
+		previous = turn['annotated'] or turn['words'] ; turn['annotated'] = texts
+		return {index : text for index,text,old in zip(turn['indices'],texts,previous)
+			if text != old}
+
+
 # Function that visualizes the syllable rate to verify predictions
 def visualize(dictionaryList):
 	allRates = []
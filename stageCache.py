@@ -0,0 +1,85 @@
+'''
+    Script that implements a content-addressed cache for the outputs of
+    post-processing stages.
+
+    Every stage output is stored under a key computed from the stage name,
+    the key of the previous stage, the contents of its input files and its
+    parameters. Changing a parameter therefore only invalidates the stage
+    that uses it and the stages after it.
+
+    Part of the Gailbot-3 development project.
+'''
+
+import os
+import json
+import pickle 									# Serializing stage outputs.
+import hashlib 									# Computing cache keys.
+import tempfile
+
+# *** Global variables / invariants ***
+
+# Hidden cache directory created in every output directory.
+cacheDirName = ".cache"
+
+# Number of bytes read from a file at a time when computing its digest.
+digestChunkSize = 1 << 20
+
+# File digests memoized by (path, size, modification time).
+fileDigests = {}
+
+
+# *** Cache key functions ***
+
+# Function that computes the digest of a file's contents.
+# The digest is memoized until the file is modified.
+# Input: Path to the file.
+# Returns: Hex digest, or None if the file does not exist.
+def fileDigest(path):
+    try: stat = os.stat(path)
+    except FileNotFoundError: return None
+    signature = (os.path.abspath(path),stat.st_size,stat.st_mtime_ns)
+    if signature not in fileDigests:
+        digest = hashlib.sha1()
+        with open(path,'rb') as f:
+            for chunk in iter(lambda: f.read(digestChunkSize),b''): digest.update(chunk)
+        fileDigests[signature] = digest.hexdigest()
+    return fileDigests[signature]
+
+# Function that computes the cache key for a stage output.
+# Input: Stage name, key of the previous stage (None for the first stage),
+#        list of input file paths, JSON serializable parameters.
+# Returns: Hex digest identifying the stage output.
+def stageKey(name,parent,files=(),params=None):
+    data = [name,parent,[fileDigest(path) for path in files],params]
+    return hashlib.sha1(json.dumps(data,sort_keys=True,default=str).encode()).hexdigest()
+
+
+# *** Cache storage functions ***
+
+# Function that loads a stage output from the cache.
+# Input: Output directory, cache key.
+# Returns: Stored value, or None if it is not cached or cannot be read.
+def load(outputDir,key):
+    try:
+        with open(os.path.join(outputDir,cacheDirName,key+".pkl"),'rb') as f:
+            return pickle.load(f)
+    except (OSError,EOFError,pickle.UnpicklingError,AttributeError,ImportError):
+        return None
+
+# Function that checks whether a stage output is cached without loading it.
+def contains(outputDir,key):
+    return os.path.isfile(os.path.join(outputDir,cacheDirName,key+".pkl"))
+
+# Function that stores a stage output in the cache.
+# The value is written to a temporary file that is renamed into place so that
+# an interrupted write never leaves a partial cache entry.
+# Input: Output directory, cache key, value to store.
+def store(outputDir,key,value):
+    cacheDir = os.path.join(outputDir,cacheDirName)
+    os.makedirs(cacheDir,exist_ok=True)
+    fd,tmpPath = tempfile.mkstemp(dir=cacheDir,suffix=".tmp")
+    try:
+        with os.fdopen(fd,'wb') as f: pickle.dump(value,f,protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath,os.path.join(cacheDir,key+".pkl"))
+    except BaseException:
+        os.remove(tmpPath) ; raise
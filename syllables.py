@@ -0,0 +1,114 @@
+'''
+    Script that provides a process-wide syllable counting service.
+
+    Syllable counts are looked up in an in-memory word cache that is backed by
+    a persistent cache file. Only words that have never been counted are
+    passed to BigPhoney, which is loaded once per process, and every unique
+    word is counted once per batch.
+
+    Part of the Gailbot-3 development project.
+'''
+
+import os
+import json
+import tempfile
+import threading
+import logging
+import fcntl 									# Locking the persistent cache file.
+
+# *** Global variables / invariants ***
+
+# Dictionary containing the syllable service parameters.
+syllableVals = {
+    "cacheFile" : "./.syllables.json"       # Persistent word -> syllable count cache, relative to Gailbot.
+}
+syllableValsOriginal = syllableVals.copy()
+
+# In-memory word -> syllable count cache.
+cache = {}
+
+# State of the service in the current process.
+service = {
+    "model" : None,             # Loaded BigPhoney instance.
+    "graph" : None,             # Graph the BigPhoney model was loaded into.
+    "loadedFile" : None         # Cache file loaded into the in-memory cache.
+}
+serviceLock = threading.RLock()
+
+
+# *** Main syllable counting functions ***
+
+# Function that counts the syllables of a list of words.
+# Empty words have no syllables.
+# Input: List of words.
+# Returns: List containing the syllable count of every word.
+def counts(words):
+    with serviceLock:
+        loadCache()
+        unknown = sorted(set(word for word in words if word not in cache and word.strip()))
+        if len(unknown) > 0:
+            phoney = model()
+            with service['graph'].as_default():
+                added = {word : phoney.count_syllables(word) for word in unknown}
+            cache.update(added) ; saveCache(added)
+        return [cache.get(word,0) for word in words]
+
+# Function that counts the syllables of a string.
+def count(text):
+    return sum(counts(text.split()))
+
+# Function that returns the BigPhoney instance.
+# BigPhoney loads a neural network and is therefore only loaded once per
+# process. Tensorflow is only imported once words have to be counted.
+def model():
+    with serviceLock:
+        if service['model'] is None:
+            from big_phoney import BigPhoney		# Finds the syllables per word.
+            import tensorflow as tf 				# Deep neural network library
+            tf.get_logger().setLevel(logging.ERROR) 	# Turning off tensorflow debugging messages.
+            service['model'] = BigPhoney()
+            service['graph'] = tf.compat.v1.get_default_graph()
+        return service['model']
+
+
+# *** Cache file functions ***
+
+# Function that loads the persistent cache into the in-memory cache.
+def loadCache():
+    if service['loadedFile'] == syllableVals['cacheFile']: return
+    cache.update(readCache())
+    service['loadedFile'] = syllableVals['cacheFile']
+
+# Function that returns the path of the persistent cache.
+# Relative paths are relative to the Gailbot directory, so that the same
+# cache is used whatever directory Gailbot is started from.
+def cachePath():
+    return os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        syllableVals['cacheFile']))
+
+# Function that reads the persistent cache.
+# Returns: Dictionary mapping words to syllable counts.
+def readCache():
+    try:
+        with open(cachePath(),'r') as f: data = json.load(f)
+    except (OSError,ValueError): return {}
+    return data if isinstance(data,dict) else {}
+
+# Function that adds words to the persistent cache.
+# The file is re-read and merged before it is replaced so that words added
+# by other processes are kept. Processes merge one at a time, holding a lock
+# on a separate lock file.
+# Input: Dictionary mapping new words to syllable counts.
+def saveCache(added):
+    path = cachePath()
+    try: lockFile = open(path+".lock",'a')
+    except OSError: return
+    with lockFile:
+        fcntl.flock(lockFile,fcntl.LOCK_EX)
+        data = readCache() ; data.update(added)
+        try: fd,tmpPath = tempfile.mkstemp(dir=os.path.dirname(path),suffix=".tmp")
+        except OSError: return
+        try:
+            with os.fdopen(fd,'w') as f: json.dump(data,f)
+            os.replace(tmpPath,path)
+        except OSError: os.remove(tmpPath)
@@ -18,6 +18,7 @@ from termcolor import colored					# Text coloring library.
 
 # Gailbot scripts
 import rateAnalysis
+import transcript 								# Transcript data model.
 
 # *** Global variables / invariants ***
 
@@ -43,20 +44,20 @@ def pauses(infoList,CHATVals):
 		for count,curr in enumerate(jsonListCombined[:-1]):
 			nxt = jsonListCombined[count+1]
 			# Only add pauses if current and next speaker is the same.
-			if curr[0] != nxt[0]:newList.append(curr);continue
-			diff = round(nxt[1] - curr[2],2)
+			if curr.speaker != nxt.speaker:newList.append(curr);continue
+			diff = round(nxt.start - curr.end,2)
 			# In this case, the latch marker is added.
 			if diff >= CHATVals['lowerBoundLatch'] and diff <= CHATVals['upperBoundLatch']:
-				curr[3] += ' ' + latchMarker + ' '
+				curr.text += ' ' + latchMarker + ' '
 			# In this case, the normal pause markers are added.
 			elif diff >= CHATVals['lowerBoundPause'] and diff <= CHATVals['upperBoundPause']:
-				curr[3] += pauseFunc(diff,closure)
+				curr.text += pauseFunc(diff,closure)
 			# In this case, micropause markers are added.
 			elif diff >= CHATVals['lowerBoundMicropause']and diff <= CHATVals['upperBoundMicropause']:
-				curr[3] += pauseFunc(diff,closure)
+				curr.text += pauseFunc(diff,closure)
 			# In this case, very large pause markers are added
 			elif diff > CHATVals['LargePause']:
-				largePause = ['*PAU',curr[2],nxt[1],pauseFunc(diff,closure)]
+				largePause = transcript.Turn('*PAU',curr.end,nxt.start,pauseFunc(diff,closure))
 				newList.extend([curr,largePause]) ; continue
 			newList.append(curr)
 		newList.append(jsonListCombined[-1])
@@ -74,9 +75,9 @@ def gaps(infoList,CHATVals):
 		newList = [] ; jsonListCombined = item[0]['jsonListCombined']
 		for count,curr in enumerate(jsonListCombined[:-1]):
 			nxt = jsonListCombined[count+1]
-			diff = round(nxt[1] - curr[2],2)
+			diff = round(nxt.start - curr.end,2)
 			if diff >= CHATVals['gap']:
-				gap = ['*GAP',curr[2],nxt[1],gapFunc(diff,closure)]
+				gap = transcript.Turn('*GAP',curr.end,nxt.start,gapFunc(diff,closure))
 				newList.extend([curr,gap]);
 			else:newList.append(curr)
 		newList.append(jsonListCombined[-1])
@@ -106,8 +107,9 @@ def transcriptionFunction(item,CHATVals):
 # Returns: Median Syllable rate per second.
 def calcSyllPerSec(jsonListCombined):
 	dictionaryList = rateAnalysis.findSyllables(jsonListCombined)
-	statsDic = rateAnalysis.stats(dictionaryList)
-	syllPerSec = statsDic['median']
+	rateStats = rateAnalysis.RateStats([dic['syllRate'] for dic in dictionaryList],
+		[dic['elem'].speaker for dic in dictionaryList])
+	syllPerSec = rateStats.fileMedian()
 	return syllPerSec
 
 
@@ -0,0 +1,224 @@
+'''
+    Script that contains the transcript data model used by the post-processing
+    modules and a streaming parser for Watson result files.
+
+    Word and turn records use __slots__ and support positional access so that
+    they can be used wherever transcript rows were previously lists:
+        [speaker, start, end, text, ...]
+
+    Part of the Gailbot-3 development project.
+'''
+
+import json
+import sys
+import itertools
+from array import array 						# Compact typed arrays.
+import numpy 									# Library to have multi-dimensional homogenous arrays.
+
+
+# *** Global variables / invariants ***
+
+# Number of characters read from a result file at a time.
+readChunkSize = 1 << 20
+
+# Characters separating the top-level objects in a result file.
+separators = ' \t\r\n,[]'
+
+
+# *** Transcript records ***
+
+# Base class for compact transcript records.
+# Trailing fields that are not set are not part of the record when it is
+# iterated e.g. when it is written to a CSV file.
+class Record:
+
+    __slots__ = ()
+
+    def __init__(self,*args):
+        for field,value in itertools.zip_longest(self.__slots__,args):
+            setattr(self,field,value)
+
+    # Function that returns the names of the fields that are set.
+    def fields(self):
+        count = len(self.__slots__)
+        while count > 4 and getattr(self,self.__slots__[count-1]) is None: count-=1
+        return self.__slots__[:count]
+
+    def __getitem__(self,index):
+        if isinstance(index,slice): return [getattr(self,field) for field in self.fields()[index]]
+        if 0 <= index < 4: return getattr(self,self.__slots__[index])
+        return getattr(self,self.fields()[index])
+
+    def __setitem__(self,index,value):
+        field = self.fields()[index] if index < 0 else self.__slots__[index]
+        setattr(self,field,value)
+
+    def __len__(self):
+        return len(self.fields())
+
+    def __iter__(self):
+        return (getattr(self,field) for field in self.fields())
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__,", ".join(repr(val) for val in self))
+
+# Class that stores a single transcribed word or word-level event.
+class Word(Record):
+
+    __slots__ = ('speaker','start','end','text','confidence','periodic',
+        'received','resultIndex')
+
+# Class that stores a single turn or turn-level event (pauses, gaps etc.)
+class Turn(Record):
+
+    __slots__ = ('speaker','start','end','text','fto')
+
+
+# *** Columnar word store ***
+
+# Class that stores word-level transcript data in columns.
+# Words and speakers are interned and stored as integer ids.
+class WordTable:
+
+    '''
+        start : Word start times (seconds).
+        end : Word end times (seconds).
+        confidence : Word confidence values.
+        periodic : Periodic flag of the result the word belongs to.
+        received : Audio received by the service for the result (seconds).
+        resultIndex : Index of the result the word belongs to.
+        wordIds : Index of the word in the vocabulary.
+        vocabulary : List of unique words.
+        labelFrom / labelTo / labelSpeaker : Speaker label intervals.
+    '''
+    def __init__(self):
+        self.start = array('d') ; self.end = array('d')
+        self.confidence = array('d') ; self.received = array('d')
+        self.periodic = array('b') ; self.resultIndex = array('l')
+        self.wordIds = array('l')
+        self.vocabulary = [] ; self.vocabularyIndex = {}
+        self.labelFrom = array('d') ; self.labelTo = array('d')
+        self.labelSpeaker = array('l')
+
+    def __len__(self):
+        return len(self.start)
+
+    # Function that adds all the words of a single result to the table.
+    # Input: Watson timestamps and word confidence lists for the result.
+    def addResult(self,timestamps,confidenceVals,periodic,received,resultIndex):
+        count = min(len(timestamps),len(confidenceVals))
+        vocabularyIndex = self.vocabularyIndex
+        for word in timestamps[:count]:
+            if word[0] not in vocabularyIndex:
+                vocabularyIndex[word[0]] = len(self.vocabulary)
+                self.vocabulary.append(sys.intern(word[0]))
+        self.wordIds.extend([vocabularyIndex[word[0]] for word in timestamps[:count]])
+        self.start.extend([word[1] for word in timestamps[:count]])
+        self.end.extend([word[2] for word in timestamps[:count]])
+        self.confidence.extend([confidence[1] for confidence in confidenceVals[:count]])
+        self.periodic.extend([periodic]*count) ; self.received.extend([received]*count)
+        self.resultIndex.extend([resultIndex]*count)
+
+    # Function that adds a speaker label interval to the table.
+    def addLabel(self,start,end,speaker):
+        self.labelFrom.append(start) ; self.labelTo.append(end)
+        self.labelSpeaker.append(speaker)
+
+    # Function that converts all columns to numpy arrays without copying.
+    def finalize(self):
+        for key in ['start','end','confidence','received','labelFrom','labelTo']:
+            setattr(self,key,numpy.frombuffer(getattr(self,key),dtype=numpy.float64))
+        for key in ['resultIndex','wordIds','labelSpeaker']:
+            setattr(self,key,numpy.frombuffer(getattr(self,key),
+                dtype=numpy.dtype('i{}'.format(getattr(self,key).itemsize))))
+        self.periodic = numpy.frombuffer(self.periodic,dtype=numpy.int8).astype(bool)
+        return self
+
+    # Function that returns the word strings of the table.
+    def words(self):
+        return [self.vocabulary[wordId] for wordId in self.wordIds]
+
+    # Function that converts the table into a list of word records.
+    # Values repeated for every word in a result are shared between records.
+    # Input: Speaker label for every word.
+    def records(self,speakers):
+        return [Word(*row) for row in zip(speakers,self.start.tolist(),
+            self.end.tolist(),self.words(),self.confidence.tolist(),
+            self.periodic.tolist(),shared(self.received.tolist()),
+            shared(self.resultIndex.tolist()))]
+
+    # Function that assigns a speaker label to every word.
+    # Performs a sorted interval join between the word midpoints and the
+    # speaker label intervals. Words outside all intervals are assigned the
+    # nearest interval. Later labels with the same start time take precedence.
+    # Returns: Array of speaker labels, all 0 if no labels were returned.
+    def speakers(self):
+        if len(self.labelFrom) == 0 or len(self.start) == 0:
+            return numpy.zeros(len(self.start),dtype=int)
+        order = numpy.argsort(self.labelFrom,kind='mergesort')
+        labelFrom = self.labelFrom[order] ; labelTo = self.labelTo[order]
+        labelSpeaker = self.labelSpeaker[order]
+        midpoints = (self.start + self.end) / 2
+        prev = numpy.searchsorted(labelFrom,midpoints,side='right') - 1
+        nxt = numpy.minimum(prev + 1,len(labelFrom) - 1)
+        prev = numpy.maximum(prev,0)
+        prevDistance = numpy.maximum(midpoints - labelTo[prev],0)
+        prevDistance[midpoints < labelFrom[prev]] = numpy.inf
+        nxtDistance = numpy.maximum(labelFrom[nxt] - midpoints,0)
+        return labelSpeaker[numpy.where(nxtDistance < prevDistance,nxt,prev)]
+
+
+# Function that replaces equal values in a list with a single shared object.
+def shared(values):
+    objects = {}
+    return [objects.setdefault(value,value) for value in values]
+
+
+# *** Streaming result file parser ***
+
+# Generator that yields the top-level result objects in a Watson result file
+# one at a time without loading the entire file.
+# Input: Path to the result file.
+def iterResults(path):
+    decoder = json.JSONDecoder()
+    with open(path) as f:
+        buffer = '' ; pos = 0 ; eof = False ; chunkSize = readChunkSize
+        while True:
+            while pos < len(buffer) and buffer[pos] in separators: pos+=1
+            if pos == len(buffer):
+                if eof: return
+                buffer = f.read(chunkSize) ; pos = 0 ; eof = len(buffer) == 0
+                continue
+            try:
+                obj,pos = decoder.raw_decode(buffer,pos)
+            except json.JSONDecodeError:
+                if eof: raise
+                # Object is incomplete: Reading more data into the buffer.
+                data = f.read(chunkSize) ; eof = len(data) == 0
+                buffer = buffer[pos:] + data ; pos = 0
+                chunkSize*=2 ; continue
+            chunkSize = readChunkSize
+            yield obj
+
+# Function that builds a word table from a Watson result file.
+# Input: Path to the result file.
+# Returns: Finalized WordTable
+def readWordTable(path):
+    table = WordTable()
+    for res in iterResults(path):
+        if "speaker_labels" in res:
+            for label in res['speaker_labels']:
+                table.addLabel(label['from'],label['to'],label['speaker'])
+            continue
+        # Extracting main fields
+        try:
+            processingMetrics = res['processing_metrics']
+            resultIndex = res['result_index'] ; results = res['results']
+            final = results[0]['final'] ; wordData = results[0]['alternatives'][0]
+            periodic = processingMetrics['periodic']
+            received = processingMetrics['processed_audio']['received']
+            confidenceVals = wordData['word_confidence'] ; words = wordData['timestamps']
+        except KeyError: continue
+        if not final: continue
+        table.addResult(words,confidenceVals,periodic,received,resultIndex)
+    return table.finalize()
@@ -0,0 +1,127 @@
+'''
+	Script that watches a directory for new media files and hands them to
+	Gailbot for transcription and post-processing as they arrive.
+
+	Part of the Gailbot-3 development project.
+
+	NOTE: Uses polling with os.scandir since inotify is not available on
+		  all supported platforms.
+'''
+
+import os, sys, time
+import signal 									# Signal handling library.
+import multiprocessing 							# Running requests in child processes.
+from termcolor import colored					# Text coloring library
+
+# Gailbot scripts
+import metaStore 								# Meta-data written once post-processing completes.
+
+# *** Global variables / invariants ***
+
+# Dictionary containing the watch-folder parameters.
+watchVals = {
+	"pollInterval" : 5,					# Seconds between successive directory scans.
+	"stableSeconds" : 10,				# Seconds a file must be unchanged to be considered complete.
+	"maxConcurrent" : 2,				# Maximum number of requests running at the same time.
+	"batchSize" : 4						# Maximum number of files sent in a single request.
+}
+watchValsOriginal = watchVals.copy()
+
+# Suffixes added by Gailbot to files extracted from the original media.
+derivedSuffixes = ["-speaker1","-speaker2"]
+
+# Child processes are forked since the twisted reactor used by the STT module
+# cannot be restarted within a single process.
+processContext = multiprocessing.get_context('fork')
+
+
+# *** Main watch-folder function ***
+
+# Function that watches a directory and processes new media files.
+# Input: Directory to watch.
+#		 Function applied to a batch of files in a separate process.
+#		 Arguments passed to the function before the batch.
+#		 Supported media extensions.
+# Runs until a keyboard interrupt is received.
+def watch(directory,target,args,extensions):
+	extensions = [ext.lower() for ext in extensions]
+	seen = {} ; dispatched = set() ; active = []
+	print(colored("Watching directory: {}".format(directory),'blue'))
+	print(colored("Press Ctrl-C to stop watching\n",'red'))
+	try:
+		while True:
+			active = [proc for proc in active if proc.is_alive()]
+			pending = [path for path in stableFiles(directory,extensions,seen)
+				if not isHandled(path,dispatched)]
+			while len(pending) > 0 and len(active) < watchVals['maxConcurrent']:
+				batch = pending[:watchVals['batchSize']]
+				pending = pending[watchVals['batchSize']:]
+				for path in batch:
+					print("Processing new file: {}".format(path))
+					dispatched.add(fileStem(path))
+				proc = processContext.Process(target=runBatch,args=(target,tuple(args)+(batch,)))
+				proc.start() ; active.append(proc)
+			time.sleep(watchVals['pollInterval'])
+	except KeyboardInterrupt:
+		print(colored("\n\nStopping watch: Waiting for {} active request(s)\n".format(
+			len(active)),'red'))
+		for proc in active: proc.join()
+
+
+# *** Helper functions ***
+
+# Function that runs a batch in a child process.
+# Keyboard interrupts are left to the watching process so that active
+# requests are completed when watching is stopped.
+# The standard input is redirected to the null device, so that prompts
+# reached by the request read end-of-file instead of blocking the process.
+def runBatch(target,args):
+	signal.signal(signal.SIGINT,signal.SIG_IGN)
+	devnull = os.open(os.devnull,os.O_RDONLY)
+	os.dup2(devnull,0) ; os.close(devnull)
+	sys.stdin = open(os.devnull,'r')
+	target(*args)
+
+# Function that returns the files in a directory that have not changed for
+# at least the stable time.
+# Input: Directory, supported extensions, dictionary of previously seen files.
+# Returns: Sorted list of complete file paths.
+def stableFiles(directory,extensions,seen):
+	now = time.time() ; stable = [] ; present = set()
+	with os.scandir(directory) as entries:
+		for entry in entries:
+			if entry.name[0] == '.' or not entry.is_file(): continue
+			if entry.name[entry.name.rfind('.')+1:].lower() not in extensions: continue
+			stat = entry.stat() ; present.add(entry.path)
+			if stat.st_size == 0: continue
+			signature = (stat.st_size,stat.st_mtime_ns)
+			if entry.path not in seen or seen[entry.path][0] != signature:
+				seen[entry.path] = (signature,now) ; continue
+			if now - seen[entry.path][1] >= watchVals['stableSeconds']:
+				stable.append(entry.path)
+	# Forgetting files that were removed from the directory.
+	for path in [path for path in seen if path not in present]: del seen[path]
+	return sorted(stable)
+
+# Function that determines whether a file has already been handled.
+# A file is handled if it was dispatched, was derived from a dispatched file
+# or an existing output directory, or has a completed Gailbot output
+# directory next to it. Output directories of failed requests are not
+# complete, so that their files are processed again.
+def isHandled(path,dispatched):
+	stem = fileStem(path)
+	if isComplete(stem): return True
+	for suffix in derivedSuffixes:
+		if not stem.endswith(suffix): continue
+		if stem[:-len(suffix)] in dispatched or os.path.isdir(stem[:-len(suffix)]): return True
+	return stem in dispatched
+
+# Function that determines whether a Gailbot output directory is complete.
+# The meta-data of a directory is only written once post-processing has finished.
+def isComplete(directory):
+	return any(os.path.isfile(os.path.join(directory,name))
+		for name in [metaStore.metaDBName,metaStore.legacyFileName])
+
+# Function that returns the file path without its extension.
+def fileStem(path):
+	return path[:path.rfind('.')]